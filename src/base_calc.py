@@ -1,72 +1,298 @@
+import asyncio
 import sqlite3
+import threading
 import requests
-from datetime import datetime
+from bisect import bisect_right
+from datetime import date as Date, timedelta
+from requests.adapters import HTTPAdapter
+import instrument
+from sync import clear_balance_checkpoint, create_tables, get_sync_state, refresh_monthly_summary, retry_call, service_url, set_sync_state
 
-def update_base_amounts(database):
-    """Recalculate and update baseAmount (EUR equivalent) for each transaction using Frankfurter API."""
-    try:
-        conn = sqlite3.connect(database)
-        cursor = conn.cursor()
+FRANKFURTER_URL = "https://api.frankfurter.app" # frankfurter_url in settings.txt overrides it
+RANGE_PADDING_DAYS = 7 # fetch a few extra days before the first date, so weekends and holidays can fall back to the previous business day
+REQUEST_TIMEOUT = 10 # seconds to connect and to wait for an answer
+MAX_CONCURRENT_REQUESTS = 4 # Frankfurter requests in flight at the same time
 
-        # Step 1: Fetch transaction data
-        cursor.execute("""
-            SELECT ti.transactionID, ti.amount, t.date, t.currency 
-            FROM TransactionItems ti
-            JOIN Transactions t ON ti.transactionID = t.transactionID
-        """)
-        transactions = cursor.fetchall()
+class RateRequestError(ValueError):
+    """Frankfurter answered with an error status; 429 and 5xx are worth another try."""
+    def __init__(self, status, text, retry_after=None):
+        super().__init__(f"HTTP {status}: {text}")
+        self.status = status
+        self.retry_after = retry_after
 
-        # Step 2: Store fetched rates to avoid duplicate API calls
-        historical_rates = {}
+    @property
+    def retryable(self):
+        return self.status == 429 or self.status >= 500
 
-        for transaction_id, amount, date, currency in transactions:
-            if currency == "EUR":
-                base_amount = round(amount, 2)
-                print(f"Transaction ID {transaction_id} is already in EUR. BaseAmount set to {base_amount:.2f}")
-            else:
-                # Convert date to YYYY-MM-DD for API
-                formatted_date = datetime.strptime(date, "%d.%m.%Y").strftime("%Y-%m-%d")
+_session = None # keep-alive connection pool shared by all requests (and worker threads)
+_session_lock = threading.Lock()
+
+def rate_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.mount("https://", HTTPAdapter(pool_maxsize=MAX_CONCURRENT_REQUESTS))
+            _session.mount("http://", HTTPAdapter(pool_maxsize=MAX_CONCURRENT_REQUESTS))
+        return _session
+
+def get_rates_json(path, params): #one Frankfurter request over the pooled session
+    response = rate_session().get(f"{service_url('frankfurter_url', FRANKFURTER_URL)}/{path}", params=params, timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        raise RateRequestError(response.status_code, response.text, response.headers.get("Retry-After"))
+    return response.json()
+
+def fetch_rate_series(currency, start, end):
+    """Fetch daily currency → EUR rates for start..end (YYYY-MM-DD) with one Frankfurter time-series request."""
+    instrument.count("frankfurter.requests")
+    with instrument.span("frankfurter.timeseries", currency=currency):
+        rates = get_rates_json(f"{start}..{end}", {"from": currency, "to": "EUR"}).get("rates", {})
+    return {day: values["EUR"] for day, values in rates.items() if "EUR" in values}
+
+def fetch_rate_table(start, end):
+    """Daily rates of every published currency → EUR for start..end, one request: {day: {currency: rate}}."""
+    instrument.count("frankfurter.requests")
+    with instrument.span("frankfurter.timeseries", currency="all"):
+        rates = get_rates_json(f"{start}..{end}", {"from": "EUR"}).get("rates", {})
+    return {day: {currency: 1 / rate for currency, rate in values.items() if rate} for day, values in rates.items()}
+
+def fetch_latest_rates(base_currency):
+    """Latest rates of every published currency, quoted from base_currency (1 base = x currency)."""
+    instrument.count("frankfurter.requests")
+    with instrument.span("frankfurter.latest"):
+        return get_rates_json("latest", {"from": base_currency}).get("rates", {})
+
+class RateFetcher:
+    """Async front end of the requests above, create one per asyncio.run().
+
+    At most max_concurrency requests run at a time, each in a worker thread over the pooled session. Timeouts,
+    connection errors, 429 and 5xx are retried by sync.retry_call, like the Splitwise calls. Requests are
+    coalesced: asks with the same key share one task, so concurrent asks for the same (currency, year) or the
+    latest rates cause one request. Time series are requested per calendar year for that reason.
+    """
+    def __init__(self, max_concurrency=MAX_CONCURRENT_REQUESTS):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.tasks = {} # key -> task, finished tasks are kept, so later asks are answered from memory
+
+    def request(self, key, func, *args):
+        task = self.tasks.get(key)
+        if task is None:
+            task = self.tasks[key] = asyncio.ensure_future(self.with_retries(func, *args))
+        return task
+
+    async def with_retries(self, func, *args):
+        async with self.semaphore: # a request waiting for its retry keeps its slot, so a 429 also slows down the others
+            return await asyncio.to_thread(retry_call, func, *args, counter="frankfurter.retries")
+
+    async def series(self, currency, start, end):
+        """currency → EUR rates of start..end, fetched as whole calendar years (up to today)."""
+        today = Date.today().isoformat()
+        end = min(end, today)
+        years = range(int(start[:4]), int(end[:4]) + 1)
+        parts = await asyncio.gather(*(self.request((currency, year), fetch_rate_series, currency, f"{year}-01-01", min(f"{year}-12-31", today))
+                                       for year in years))
+        return {day: rate for part in parts for day, rate in part.items() if start <= day <= end}
+
+    async def latest(self, base_currency):
+        return await self.request(("latest", base_currency), fetch_latest_rates, base_currency)
 
-                # Check if we already have the rate for this currency and date
-                if (currency, formatted_date) not in historical_rates:
-                    try:
-                        url = f"https://api.frankfurter.app/{formatted_date}"
-                        params = {"from": currency, "to": "EUR"}
-                        response = requests.get(url, params=params)
+def fetch_rate_ranges(ranges):
+    """Fetch several (currency, start, end) ranges concurrently. Returns {range: rates dict, or the exception}."""
+    async def fetch_all():
+        fetcher = RateFetcher()
+        results = await asyncio.gather(*(fetcher.series(*rate_range) for rate_range in ranges), return_exceptions=True)
+        return dict(zip(ranges, results))
+    return asyncio.run(fetch_all()) if ranges else {}
 
-                        if response.status_code != 200:
-                            raise ValueError(f"HTTP {response.status_code}: {response.text}")
+def latest_rates(base_currency="EUR"):
+    """fetch_latest_rates with the timeout and retry handling of RateFetcher."""
+    async def fetch():
+        return await RateFetcher().latest(base_currency)
+    return asyncio.run(fetch())
 
-                        data = response.json()
-                        rate = data.get("rates", {}).get("EUR")
+def easter_sunday(year): #anonymous Gregorian algorithm (Meeus/Jones/Butcher)
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return Date(year, month, day + 1)
 
-                        if rate is None:
-                            raise ValueError(f"No EUR rate found for {currency} on {formatted_date}")
+def is_ecb_business_day(day):
+    """True if the ECB publishes reference rates on day: weekdays except the TARGET holidays."""
+    if day.weekday() >= 5 or (day.month, day.day) in ((1, 1), (5, 1), (12, 25), (12, 26)):
+        return False
+    easter = easter_sunday(day.year)
+    return day not in (easter - timedelta(days=2), easter + timedelta(days=1)) # Good Friday, Easter Monday
 
-                        historical_rates[(currency, formatted_date)] = rate
-                        print(f"Fetched {currency} → EUR rate for {formatted_date}: {rate}")
+def pending_business_day(published, end):
+    """True if a business day after the last published rate (yyyy-mm-dd) up to end may still get a rate."""
+    day = Date.fromisoformat(published) + timedelta(days=1)
+    while day <= Date.fromisoformat(end):
+        if is_ecb_business_day(day):
+            return True
+        day += timedelta(days=1)
+    return False
 
-                    except Exception as e:
-                        print(f"Error fetching rate for {currency} on {formatted_date}: {e}")
-                        continue
+@instrument.traced("fx.fill_rate_caches")
+def fill_rate_caches(conn, date_spans):
+    """Make sure FxRates covers first_date..last_date of every currency in date_spans {currency: (first_date, last_date)}.
 
+    Only the missing edges are requested, for all currencies at once. A currency whose request failed keeps its old
+    coverage, so the next run asks again.
+    """
+    today = Date.today().isoformat()
+    plans = {} # currency -> (missing ranges, covered start, covered end)
+    for currency, (first_date, last_date) in date_spans.items():
+        start = (Date.fromisoformat(first_date) - timedelta(days=RANGE_PADDING_DAYS)).isoformat()
+        end = min(last_date, today)
+        covered = get_sync_state(conn, f"fx_range_{currency}") # SyncState entry "start..end" of the span already stored
+        if covered:
+            covered_start, covered_end = covered.split("..")
+            missing = []
+            if start < covered_start:
+                missing.append((start, (Date.fromisoformat(covered_start) - timedelta(days=1)).isoformat()))
+            if end > covered_end:
+                missing.append(((Date.fromisoformat(covered_end) + timedelta(days=1)).isoformat(), end))
+            start, end = min(start, covered_start), max(end, covered_end)
+        else:
+            missing = [(start, end)]
+        plans[currency] = (missing, start, end)
+
+    results = fetch_rate_ranges([(currency, missing_start, missing_end)
+                                 for currency, (missing, _, _) in plans.items() for missing_start, missing_end in missing])
+    for currency, (missing, start, end) in plans.items():
+        failed = False
+        for missing_start, missing_end in missing:
+            rates = results[(currency, missing_start, missing_end)]
+            if isinstance(rates, Exception):
+                print(f"Error fetching rates for {currency}: {rates}")
+                failed = True
+                continue
+            conn.executemany("INSERT OR REPLACE INTO FxRates (currency, date, rate) VALUES (?, ?, ?)",
+                             [(currency, day, rate) for day, rate in rates.items()])
+            print(f"Fetched {len(rates)} {currency} → EUR rates for {missing_start}..{missing_end}")
+            if missing_end == today: # today's rate may not be published yet, so only what came back counts as covered
+                published = max(rates) if rates else (Date.fromisoformat(missing_start) - timedelta(days=1)).isoformat()
+                if pending_business_day(published, today): # ... unless no rate is due after it (weekend, holiday)
+                    end = published
+        if not failed:
+            set_sync_state(conn, f"fx_range_{currency}", f"{start}..{end}")
+    conn.commit()
+
+def load_rates(conn, currency):
+    """All stored rates of a currency as two sorted lists (dates, rates) for lookups with bisect."""
+    rows = conn.execute("SELECT date, rate FROM FxRates WHERE currency = ? ORDER BY date", (currency,)).fetchall()
+    return [row[0] for row in rows], [row[1] for row in rows]
+
+def lookup_rate(dates, rates, day):
+    """Rate of the day, or of the previous business day if there is none (weekends, holidays)."""
+    index = bisect_right(dates, day)
+    return rates[index - 1] if index else None
+
+def convert_online(conn, items):
+    """(updates, months) of update_base_amounts with rates from FxRates, missing ones are requested first."""
+    # Fill the rate cache, only spans that are not stored yet are requested (one request per currency and year)
+    date_spans = {}
+    for _, _, date, currency, _ in items:
+        if currency != "EUR" and date:
+            first, last = date_spans.get(currency, (date, date))
+            date_spans[currency] = (min(first, date), max(last, date))
+
+    fill_rate_caches(conn, date_spans) # all currencies concurrently
+    historical_rates = {currency: load_rates(conn, currency) for currency in date_spans}
+
+    with instrument.span("base_amounts.convert", items=len(items)):
+        updates = []
+        months = set() #months whose MonthlySummary totals change
+        for item_id, amount, date, currency, updated in items:
+            if amount is None:
+                continue
+            if currency == "EUR":
+                base_amount = round(amount, 2)
+            else:
                 # Convert amount to EUR
-                rate = historical_rates.get((currency, formatted_date))
+                dates, rates = historical_rates.get(currency, ([], []))
+                rate = lookup_rate(dates, rates, date) if date else None
                 if rate:
                     base_amount = round(amount * rate, 2)  # rate is from currency → EUR
-                    print(f"Updated transaction ID {transaction_id} with baseAmount {base_amount:.2f}")
                 else:
-                    print(f"Missing rate for {currency} on {formatted_date}")
+                    print(f"Missing rate for {currency} on {date}")
                     continue
+            updates.append((base_amount, updated, item_id))
+            if date:
+                months.add(date[:7])
+    return updates, months
 
-            # Step 3: Update database
+def convert_offline(items):
+    """(updates, months) of update_base_amounts with rates from the memory-mapped FX dataset, no requests."""
+    import numpy as np
+    from fx_dataset import open_dataset
+    dataset = open_dataset()
+    if dataset is None:
+        raise ValueError("No FX dataset, run fx_dataset.py (or personal_finance.py fx-refresh) first")
+    with instrument.span("base_amounts.convert_offline", items=len(items)):
+        items = [item for item in items if item[1] is not None]
+        amounts = np.fromiter((item[1] for item in items), dtype=np.float64, count=len(items))
+        currencies = [item[3] for item in items]
+        rates = dataset.lookup(currencies, [item[2] for item in items])
+        rates[np.array([currency == "EUR" for currency in currencies], dtype=bool)] = 1.0 # also outside the dataset
+        base_amounts = np.round(amounts * rates, 2) # rate is from currency → EUR
+        updates = []
+        months = set() #months whose MonthlySummary totals change
+        for (item_id, _, date, currency, updated), base_amount in zip(items, base_amounts.tolist()):
+            if base_amount != base_amount: # NaN: no rate in the dataset
+                print(f"Missing rate for {currency} on {date}")
+                continue
+            updates.append((base_amount, updated, item_id))
+            if date:
+                months.add(date[:7])
+    return updates, months
+
+def update_base_amounts(database, full=False, offline=False):
+    """Calculate baseAmount (EUR equivalent) using rates cached in the FxRates table.
+
+    Only items without a baseAmount or whose transaction was updated since the last calculation are
+    processed, full=True recalculates every item. offline=True reads the rates from the FX dataset
+    (see fx_dataset.py) in one array lookup instead, without any request.
+    """
+    try:
+        conn = sqlite3.connect(database)
+        create_tables(conn) #makes sure dates are stored as yyyy-mm-dd
+        cursor = conn.cursor()
+
+        # Step 1: Fetch the items that need a (new) base amount
+        with instrument.span("sql.select_changed_items"):
             cursor.execute("""
+                SELECT ti.itemID, ti.amount, t.date, t.currency, t.updated
+                FROM TransactionItems ti
+                JOIN Transactions t ON ti.transactionID = t.transactionID
+            """ + ("" if full else "WHERE ti.baseAmount IS NULL OR ti.baseUpdated IS NOT t.updated"))
+            items = cursor.fetchall()
+
+        # Step 2: Convert the amounts to EUR
+        if offline:
+            updates, months = convert_offline(items)
+        else:
+            updates, months = convert_online(conn, items)
+
+        # Step 3: Update database, keyed by itemID in one batch
+        with instrument.span("sql.update_base_amounts", rows=len(updates)):
+            cursor.executemany("""
                 UPDATE TransactionItems
-                SET baseAmount = ?
-                WHERE transactionID = ? AND amount = ?
-            """, (base_amount, transaction_id, amount))
+                SET baseAmount = ?, baseUpdated = ?
+                WHERE itemID = ?
+            """, updates)
+        refresh_monthly_summary(conn, months)
+        if updates: #base amounts of already counted items changed
+            clear_balance_checkpoint(conn)
 
         conn.commit()
+        print(f"Updated baseAmount of {len(updates)} of {len(items)} changed transaction items")
 
     except sqlite3.Error as e:
         print(f"Database error: {e}")
@@ -77,5 +303,6 @@ def update_base_amounts(database):
         print("Base amounts updated successfully!")
 
 if __name__ == "__main__":
+    import sys
     database = "98754612.sqlite"
-    update_base_amounts(database)
\ No newline at end of file
+    update_base_amounts(database, full="--full" in sys.argv, offline="--offline" in sys.argv)
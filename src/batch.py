@@ -0,0 +1,70 @@
+# Batch generation of reports and forecasts for every user database in data/, without any Splitwise call.
+# Usage: python batch.py [--data data] [--reports reports] [--workers 4] [--years 3] [--no-forecast]
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+def discover_databases(data_dir="data"):
+    """(user ID, path) of every <user ID>.sqlite file in data_dir, sorted by user ID."""
+    databases = []
+    for file_name in sorted(os.listdir(data_dir)):
+        stem, extension = os.path.splitext(file_name)
+        if extension == ".sqlite" and stem.isdigit():
+            databases.append((int(stem), os.path.join(data_dir, file_name)))
+    return databases
+
+def run_user(user_id, database_name, reports_dir, nr_years):
+    """Report and forecast of one user, runs in a worker process. Returns (user ID, status, seconds)."""
+    import reporting
+    import prediction
+    from unrec_transact import income_expenses
+
+    started = time.perf_counter()
+    today = datetime.now().strftime("%Y-%m-%d")
+    try:
+        report = reporting.reporting(user_id, database_name, os.path.join(reports_dir, f"{user_id}_{today}.pdf"), chart_workers=1)
+        if report is None:
+            return user_id, "no report data", time.perf_counter() - started
+        if nr_years:
+            income, expenses = income_expenses(database_name) # recorded balance, the fact balance needs user input
+            result = prediction.forecast(database_name, income - expenses, nr_years)
+            if result is not None:
+                prediction.render_prediction_pdf(result, os.path.join(reports_dir, f"{user_id}_{today}_prediction.pdf"))
+        return user_id, "ok", time.perf_counter() - started
+    except Exception as e:
+        return user_id, f"error: {e}", time.perf_counter() - started
+
+def run_batch(data_dir="data", reports_dir="reports", max_workers=None, nr_years=3):
+    """Run all users in a process pool with at most max_workers processes and print a summary."""
+    databases = discover_databases(data_dir)
+    os.makedirs(reports_dir, exist_ok=True)
+    print(f"Found {len(databases)} user databases in {data_dir}")
+
+    started = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(run_user, user_id, path, reports_dir, nr_years) for user_id, path in databases]
+        for future in as_completed(futures):
+            results.append(future.result())
+    total = time.perf_counter() - started
+
+    # run summary
+    print(f"\n{'User ID':>12}  {'Seconds':>8}  Status")
+    for user_id, status, seconds in sorted(results):
+        print(f"{user_id:>12}  {seconds:8.2f}  {status}")
+    succeeded = sum(1 for _, status, _ in results if status == "ok")
+    print(f"\n{succeeded} of {len(results)} users done in {total:.2f} s")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate reports and forecasts for all user databases.")
+    parser.add_argument("--data", default="data", help="folder with the <user ID>.sqlite files")
+    parser.add_argument("--reports", default="reports", help="output folder for the .pdf files")
+    parser.add_argument("--workers", type=int, default=None, help="number of parallel processes (default: number of CPUs)")
+    parser.add_argument("--years", type=int, default=3, help="years to predict")
+    parser.add_argument("--no-forecast", action="store_true", help="only generate the reports")
+    args = parser.parse_args()
+    run_batch(args.data, args.reports, args.workers, 0 if args.no_forecast else args.years)
@@ -0,0 +1,52 @@
+# Import-time benchmark of the command line: starts a fresh interpreter per run and measures how long
+# "personal_finance.py <command>" needs to import everything that command loads.
+# Usage: python bench_startup.py [--runs 5] [--budget-ms 200]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# modules imported by each subcommand before it does any work
+COMMAND_IMPORTS = {
+    "sync": ["sync"],
+    "income": ["income", "sync"],
+    "base-amounts": ["base_calc"],
+    "reconcile": ["unrec_transact"],
+    "predict": ["prediction", "unrec_transact"],
+    "report": ["reporting"],
+}
+LIGHT_COMMANDS = ["sync", "income"] # these must stay within the budget
+
+def startup_ms(modules, runs):
+    """Median wall time (ms) of a fresh interpreter that imports the CLI and the given modules."""
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    code = "import personal_finance; personal_finance.build_parser()" + "".join(f"; import {module}" for module in modules)
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=src_dir, check=True)
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+def run_benchmark(runs=5, budget_ms=200):
+    """Print the startup time of every subcommand, returns False if a light command is over the budget."""
+    ok = True
+    print(f"{'Command':<14}{'ms':>8}")
+    print(f"{'(cli only)':<14}{startup_ms([], runs):8.0f}")
+    for command, modules in COMMAND_IMPORTS.items():
+        milliseconds = startup_ms(modules, runs)
+        light = command in LIGHT_COMMANDS
+        over = light and milliseconds > budget_ms
+        ok = ok and not over
+        print(f"{command:<14}{milliseconds:8.0f}" + ("  over budget" if over else ""))
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the startup time of the personal-finance subcommands.")
+    parser.add_argument("--runs", type=int, default=5, help="interpreter starts per command, the median is reported")
+    parser.add_argument("--budget-ms", type=float, default=200, help="limit for the light commands (sync, income)")
+    args = parser.parse_args()
+    sys.exit(0 if run_benchmark(args.runs, args.budget_ms) else 1)
@@ -0,0 +1,177 @@
+# Benchmark of every pipeline stage on a synthetic ledger (see generate_ledger.py). FX and Splitwise calls are
+# replaced by local stand-ins, so the timings only measure this code. Results are written as JSON to compare commits.
+# Usage: python benchmark.py [--items 10000] [--repeat 3] [--output benchmark.json] [--compare old.json]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+import base_calc
+import generate_ledger
+import prediction
+import reporting
+import sync
+import unrec_transact
+
+STAGES = ["base_amounts", "income_expenses", "income_expenses_checkpoint", "forecast", "forecast_pdf",
+          "prepare_transactions", "generate_charts", "generate_pdf_report", "sync_write"]
+SYNC_CHANGES = 1000 # expenses per benchmarked sync: 80% changed, 10% new, 10% deleted
+
+def fake_expenses(conn, nr_changes, seed=1):
+    """Splitwise expense objects as getExpenses returns them: changes of existing rows, new rows and deletions."""
+    rng = random.Random(seed)
+    max_id = conn.execute("SELECT MAX(transactionID) FROM Transactions").fetchone()[0] or 0
+    existing = rng.sample(range(1, max_id + 1), min(nr_changes, max_id))
+    expenses = []
+    for index, expense_id in enumerate(existing):
+        if index % 10 == 9: # new expense
+            expense_id = max_id + index + 1
+        category = SimpleNamespace(name=rng.choice(generate_ledger.EXPENSE_SUBCATEGORIES)[1])
+        users = [SimpleNamespace(id=generate_ledger.USER_ID, paid_share=f"{rng.uniform(5, 200):.2f}"),
+                 SimpleNamespace(id=generate_ledger.FRIEND_IDS[0], paid_share="0.00")]
+        expenses.append(SimpleNamespace(
+            id=expense_id, deleted_at="2025-01-01T00:00:00Z" if index % 10 == 8 else None,
+            date=f"2025-{1 + index % 12:02d}-{1 + index % 28:02d}T12:00:00Z", category=category, repeat_interval=None,
+            group_id=None, description=category.name, currency_code=rng.choice(["EUR", "USD", "GBP"]),
+            updated_at=datetime.now().isoformat(timespec="seconds") + "Z", users=users))
+    return expenses
+
+def timed(func, repeat, setup=None):
+    """Seconds of every run of func(); setup() runs before each run and is not timed, its result is passed on."""
+    runs = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        func(argument) if setup else func()
+        runs.append(time.perf_counter() - started)
+    return runs
+
+def run_benchmarks(database_name, repeat=3, stages=STAGES, nr_years=3):
+    """Time each stage on working copies of database_name. Returns {stage: {"median": s, "runs": [...]}}."""
+    work_dir = tempfile.mkdtemp(prefix="pf-bench-")
+    base_calc.fetch_rate_series = generate_ledger.synthetic_rate_series # no Frankfurter calls
+    results = {}
+
+    def fresh_copy(): #stages that write get their own copy of the ledger
+        path = os.path.join(work_dir, "ledger.sqlite")
+        shutil.copyfile(database_name, path)
+        return path
+
+    def sync_write(path):
+        conn = sqlite3.connect(path)
+        cursor = conn.cursor()
+        subcategory_dict = {name: id_ for id_, name in conn.execute("SELECT subcategoryID, subcategory FROM Subcategories")}
+        sync.write_expenses(cursor, fake_expenses(conn, SYNC_CHANGES), subcategory_dict)
+        conn.commit()
+        conn.close()
+
+    df = charts = result = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()): # the modules print progress for interactive use
+            for stage in stages:
+                try:
+                    if stage == "base_amounts":
+                        runs = timed(lambda path: base_calc.update_base_amounts(path, full=True), repeat, fresh_copy)
+                    elif stage == "income_expenses":
+                        runs = timed(lambda: unrec_transact.income_expenses(database_name, checkpoint=False), repeat)
+                    elif stage == "income_expenses_checkpoint":
+                        def with_checkpoint():
+                            path = fresh_copy()
+                            unrec_transact.income_expenses(path) # stores the checkpoint
+                            return path
+                        runs = timed(lambda path: unrec_transact.income_expenses(path), repeat, with_checkpoint)
+                    elif stage == "forecast":
+                        runs = timed(lambda: prediction.forecast(database_name, 1000.0, nr_years, use_cache=False), repeat)
+                        result = prediction.forecast(database_name, 1000.0, nr_years, use_cache=False)
+                    elif stage == "forecast_pdf":
+                        result = result or prediction.forecast(database_name, 1000.0, nr_years, use_cache=False)
+                        runs = timed(lambda: prediction.render_prediction_pdf(result, os.path.join(work_dir, "prediction.pdf")), repeat)
+                    elif stage == "prepare_transactions":
+                        runs = timed(lambda: reporting.prepare_transactions(None, database_name), repeat)
+                    elif stage == "generate_charts":
+                        df = reporting.prepare_transactions(None, database_name)
+                        runs = timed(lambda: reporting.generate_charts(df), repeat)
+                    elif stage == "generate_pdf_report":
+                        df = df if df is not None else reporting.prepare_transactions(None, database_name)
+                        charts = reporting.generate_charts(df)
+                        def fresh_charts(): #the report reads the chart buffers, so each run gets rewound ones
+                            for buffer in [charts['income_vs_expenses'], charts['total_income_vs_expenses'], *charts['expense_pie'].values()]:
+                                buffer.seek(0)
+                        runs = timed(lambda _: reporting.generate_pdf_report(df, charts, 0, os.path.join(work_dir, "report.pdf")), repeat, fresh_charts)
+                    elif stage == "sync_write":
+                        runs = timed(sync_write, repeat, fresh_copy)
+                    else:
+                        raise ValueError(f"Unknown stage: {stage}")
+                    results[stage] = {"median": statistics.median(runs), "runs": runs}
+                except Exception as e:
+                    results[stage] = {"error": str(e)}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def git_commit(): #commit of the benchmarked code, None outside a git checkout
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, previous=None):
+    print(f"{'Stage':<28}{'Median s':>10}" + (f"{'Before s':>10}{'Change':>9}" if previous else ""))
+    for stage, result in results.items():
+        if "error" in result:
+            print(f"{stage:<28}  error: {result['error']}")
+            continue
+        line = f"{stage:<28}{result['median']:10.4f}"
+        before = (previous or {}).get(stage, {}).get("median")
+        if before:
+            line += f"{before:10.4f}{(result['median'] / before - 1) * 100:+8.1f}%"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on a synthetic ledger.")
+    parser.add_argument("--items", type=int, default=10000, help="size of the synthetic ledger in TransactionItems")
+    parser.add_argument("--database", default=None, help="benchmark this database instead of a synthetic one")
+    parser.add_argument("--ledger-dir", default="benchmarks", help="generated ledgers are kept here and reused")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the median is reported")
+    parser.add_argument("--years", type=int, default=3, help="forecast length")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES, help="stages to run (default: all)")
+    parser.add_argument("--output", default=None, help="JSON result file (default: <ledger dir>/<commit>_<items>.json)")
+    parser.add_argument("--compare", default=None, help="earlier JSON result to compare with")
+    args = parser.parse_args()
+
+    database_name = args.database
+    if database_name is None:
+        os.makedirs(args.ledger_dir, exist_ok=True)
+        database_name = os.path.join(args.ledger_dir, f"ledger_{args.items}.sqlite")
+        if not os.path.exists(database_name):
+            generate_ledger.generate_ledger(database_name, args.items)
+    conn = sqlite3.connect(database_name)
+    nr_items, = conn.execute("SELECT COUNT(*) FROM TransactionItems").fetchone()
+    conn.close()
+
+    results = run_benchmarks(database_name, args.repeat, args.stages, args.years)
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)["stages"]
+    print_results(results, previous)
+
+    commit = git_commit()
+    output = args.output or os.path.join(args.ledger_dir, f"{commit or 'local'}_{nr_items}.json")
+    with open(output, "w") as file:
+        json.dump({"commit": commit, "created": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                   "platform": platform.platform(), "database": database_name, "items": nr_items, "repeat": args.repeat,
+                   "stages": results}, file, indent=2)
+    print(f"Results saved as {output}")
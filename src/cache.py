@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import instrument
+from sync import LEDGER_REVISION_KEY
+
+CACHE_DIR = "cache" # results are stored as pickle files in this folder (current directory)
+MAX_CACHE_BYTES = 200 * 1024 * 1024 # least recently used files are deleted above this size
+
+def ledger_fingerprint(database_name):
+    """Constant-time fingerprint of the ledger: the ledger revision and the highest transaction and item IDs.
+
+    Every sync, income entry, unrecorded transaction and base amount update raises the revision (they all refresh
+    MonthlySummary, see sync.refresh_monthly_summary), and the IDs also catch rows appended by other tools.
+    """
+    conn = sqlite3.connect(database_name)
+    try:
+        state = [
+            conn.execute("SELECT value FROM SyncState WHERE key = ?", (LEDGER_REVISION_KEY,)).fetchone(),
+            conn.execute("SELECT MAX(transactionID) FROM Transactions").fetchone(),
+            conn.execute("SELECT MAX(itemID) FROM TransactionItems").fetchone(),
+        ]
+    finally:
+        conn.close()
+    return hashlib.sha256(repr(state).encode()).hexdigest()
+
+def cache_key(database_name, name, params):
+    """Key of a result: what was computed (name), with which parameters, on which ledger state."""
+    text = json.dumps([os.path.abspath(database_name), name, params, ledger_fingerprint(database_name)], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def load(key):
+    path = os.path.join(CACHE_DIR, f"{key}.pickle")
+    try:
+        with open(path, "rb") as file:
+            value = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError): # also a file evicted by another process meanwhile
+        return None
+    try:
+        os.utime(path) # mark as recently used
+    except OSError: # evicted by another process after reading, the value is still good
+        pass
+    return value
+
+def store(key, value):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, f"{key}.pickle")
+    temp_path = f"{path}.{os.getpid()}.tmp" # write and rename, so parallel runs never read half a file
+    with open(temp_path, "wb") as file:
+        pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+    evict()
+
+def evict(max_bytes=MAX_CACHE_BYTES):
+    """Delete the least recently used files until the cache is smaller than max_bytes."""
+    entries = []
+    for file_name in os.listdir(CACHE_DIR):
+        if file_name.endswith(".pickle"):
+            try:
+                stat = os.stat(os.path.join(CACHE_DIR, file_name))
+            except OSError: # deleted by another process since the listing
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, file_name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(CACHE_DIR, file_name))
+        except OSError:
+            pass
+        total -= size
+
+def cached(database_name, name, params, compute):
+    """Return the stored result for (ledger state, name, params), or compute and store it."""
+    try:
+        key = cache_key(database_name, name, params)
+    except sqlite3.Error as e: # no usable ledger, nothing to cache
+        print(f"Cache disabled: {e}")
+        return compute()
+    value = load(key)
+    instrument.count(f"cache.{'miss' if value is None else 'hit'}")
+    if value is None:
+        value = compute()
+        if value is not None:
+            store(key, value)
+    return value
@@ -0,0 +1,155 @@
+# Offline copy of the ECB reference rates (through Frankfurter) of every currency and day, for base amounts and
+# reconciliations without network calls. The rates are stored as one binary float64 array of shape (days, currencies)
+# (currency → EUR, NaN where no rate was published) that is memory-mapped for lookups, next to a small JSON index.
+# Refreshing appends the days published since the last refresh; only a new currency rewrites the file.
+# Usage: python fx_dataset.py [--dir fx] [--since 1999-01-04]
+
+import argparse
+import asyncio
+import json
+import os
+from datetime import date as Date, timedelta
+import numpy as np
+import instrument
+
+DATASET_DIR = "fx" # current directory, like the cache folder
+INDEX_FILE = "rates.json"
+FIRST_DAY = "1999-01-04" # first ECB reference rates
+MAX_FALLBACK_DAYS = 7 # a day without a rate uses the previous business day, at most this many days back
+
+class FxDataset:
+    """Memory-mapped rate table, rates[day offset, currency column] = currency → EUR rate of that day."""
+    def __init__(self, folder, index):
+        self.folder = folder
+        self.start = Date.fromisoformat(index["start"])
+        self.days = index["days"]
+        self.currencies = index["currencies"]
+        self.columns = {currency: column for column, currency in enumerate(self.currencies)}
+        path = os.path.join(folder, index["file"])
+        self.rates = np.memmap(path, dtype="<f8", mode="r", shape=(self.days, len(self.currencies))) if self.days else np.empty((0, len(self.currencies)))
+
+    @property
+    def end(self):
+        return self.start + timedelta(days=self.days - 1)
+
+    def lookup(self, currencies, days):
+        """Rates (currency → EUR) of sequences of currencies and yyyy-mm-dd days as one float array, NaN if unknown.
+
+        Days without a published rate (weekends, holidays) use the previous business day, so do days shortly after
+        the last refresh.
+        """
+        count = len(currencies)
+        columns = np.fromiter((self.columns.get(currency, -1) for currency in currencies), dtype=np.int64, count=count)
+        offsets = (np.array([day or "NaT" for day in days], dtype="datetime64[D]") - np.datetime64(self.start, "D")).astype(np.int64)
+        result = np.full(count, np.nan)
+        pending = (columns >= 0) & (offsets >= 0) # NaT turns into a large negative offset
+        for back in range(MAX_FALLBACK_DAYS + 1):
+            rows = offsets - back
+            candidates = np.flatnonzero(pending & (rows >= 0) & (rows < self.days))
+            if not len(candidates):
+                break
+            found = self.rates[rows[candidates], columns[candidates]]
+            published = ~np.isnan(found)
+            result[candidates[published]] = found[published]
+            pending[candidates[published]] = False
+        return result
+
+    def latest(self):
+        """The newest rate of every currency: {currency: rate → EUR}."""
+        latest = {}
+        for row in range(self.days - 1, max(self.days - 1 - MAX_FALLBACK_DAYS, -1), -1):
+            for currency, rate in zip(self.currencies, self.rates[row]):
+                if currency not in latest and not np.isnan(rate):
+                    latest[currency] = float(rate)
+        return latest
+
+def read_index(folder):
+    try:
+        with open(os.path.join(folder, INDEX_FILE)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+def write_index(folder, index): #write and rename, so readers never see half an index
+    temp_path = os.path.join(folder, f"{INDEX_FILE}.{os.getpid()}.tmp")
+    with open(temp_path, "w") as file:
+        json.dump(index, file, indent=1)
+    os.replace(temp_path, os.path.join(folder, INDEX_FILE))
+
+def open_dataset(folder=DATASET_DIR):
+    """The dataset in folder, or None if it was never refreshed."""
+    index = read_index(folder)
+    return FxDataset(folder, index) if index else None
+
+def fetch_days(start, end):
+    """All rates of start..end as {day: {currency: rate → EUR}}, one request per calendar year, all years at once."""
+    from base_calc import RateFetcher, fetch_rate_table
+
+    async def fetch_all():
+        fetcher = RateFetcher()
+        chunks = [(max(start, f"{year}-01-01"), min(end, f"{year}-12-31")) for year in range(int(start[:4]), int(end[:4]) + 1)]
+        parts = await asyncio.gather(*(fetcher.request(("table", chunk), fetch_rate_table, *chunk) for chunk in chunks))
+        return {day: rates for part in parts for day, rates in part.items()}
+    return asyncio.run(fetch_all())
+
+@instrument.traced("fx.refresh_dataset")
+def refresh_dataset(folder=DATASET_DIR, since=FIRST_DAY):
+    """Download the days published since the last refresh (everything from since on the first run).
+
+    The index is replaced only after the rates are written: readers either see the old days or the new ones.
+    """
+    os.makedirs(folder, exist_ok=True)
+    index = read_index(folder) or {"start": since, "days": 0, "currencies": ["EUR"], "file": "rates_1.bin", "generation": 1}
+    start = Date.fromisoformat(index["start"])
+    first_missing = start + timedelta(days=index["days"])
+    today = Date.today()
+    if first_missing > today:
+        print("FX dataset is up to date")
+        return index
+    rates = fetch_days(first_missing.isoformat(), today.isoformat())
+    rates = {day: values for day, values in rates.items() if day >= first_missing.isoformat()}
+    if not rates:
+        print(f"No new rates since {first_missing - timedelta(days=1)}")
+        return index
+
+    currencies = index["currencies"] + sorted({currency for values in rates.values() for currency in values} - set(index["currencies"]))
+    columns = {currency: column for column, currency in enumerate(currencies)}
+    last_day = Date.fromisoformat(max(rates))
+    new_rows = np.full(((last_day - first_missing).days + 1, len(currencies)), np.nan)
+    new_rows[:, columns["EUR"]] = 1.0
+    for day, values in rates.items():
+        row = (Date.fromisoformat(day) - first_missing).days
+        for currency, rate in values.items():
+            new_rows[row, columns[currency]] = rate
+
+    old_path = os.path.join(folder, index["file"])
+    row_bytes = len(index["currencies"]) * 8
+    if currencies == index["currencies"]: # same columns: append the new days to the file
+        mode = "r+b" if os.path.exists(old_path) else "wb"
+        with open(old_path, mode) as file:
+            file.truncate(index["days"] * row_bytes) # bytes of an interrupted refresh that the index does not cover
+            file.seek(0, os.SEEK_END)
+            file.write(new_rows.astype("<f8").tobytes())
+        old_path = None
+    else: # new currency: write a new file with the extra columns, the old one stays valid until the index is replaced
+        index["generation"] += 1
+        index["file"] = f"rates_{index['generation']}.bin"
+        table = np.full((index["days"], len(currencies)), np.nan)
+        if index["days"]:
+            table[:, :len(index["currencies"])] = np.fromfile(old_path, dtype="<f8", count=index["days"] * len(index["currencies"])).reshape(index["days"], -1)
+        with open(os.path.join(folder, index["file"]), "wb") as file:
+            file.write(table.astype("<f8").tobytes())
+            file.write(new_rows.astype("<f8").tobytes())
+    index.update(days=index["days"] + len(new_rows), currencies=currencies, updated=today.isoformat())
+    write_index(folder, index)
+    if old_path and os.path.exists(old_path):
+        os.remove(old_path)
+    print(f"FX dataset: {len(rates)} new days ({first_missing}..{last_day}), {len(currencies)} currencies, {index['days']} days in total")
+    return index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download or update the offline FX rate dataset.")
+    parser.add_argument("--dir", default=DATASET_DIR, help="dataset folder")
+    parser.add_argument("--since", default=FIRST_DAY, help="first day of a new dataset (yyyy-mm-dd)")
+    args = parser.parse_args()
+    refresh_dataset(args.dir, args.since)
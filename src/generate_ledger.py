@@ -0,0 +1,156 @@
+# Synthetic user databases with the schema of sync.create_tables, for benchmarks and tests at any scale.
+# Usage: python generate_ledger.py --items 1000000 [--years 5] [--seed 1] [--output ledger.sqlite]
+
+import argparse
+import math
+import os
+import random
+import sqlite3
+import time
+from datetime import date as Date, datetime, timedelta
+from sync import create_tables, refresh_monthly_summary
+
+USER_ID = 424242 # owner of the generated ledger
+FRIEND_IDS = list(range(500001, 500021))
+GROUP_IDS = [None, 9001, 9002, 9003, 9004]
+
+# Splitwise subcategories (ID, name, weight, typical amount in EUR), weighted like an everyday ledger
+EXPENSE_SUBCATEGORIES = [
+    (12, 'Groceries', 30, 45), (13, 'Dining out', 15, 35), (33, 'Gas/fuel', 8, 60), (32, 'Bus/train', 6, 12),
+    (36, 'Taxi', 3, 25), (14, 'Household supplies', 6, 20), (41, 'Clothing', 4, 70), (39, 'Electronics', 2, 250),
+    (21, 'Movies', 3, 15), (24, 'Sports', 2, 40), (43, 'Medical expenses', 2, 80), (47, 'Hotel', 1, 180),
+    (35, 'Plane', 1, 220), (42, 'Gifts', 2, 50), (18, 'General', 5, 30), (38, 'Liquor', 2, 25),
+]
+INCOME_SUBCATEGORIES = [(101, 'Salary'), (102, 'Business'), (103, 'Gifts'), (104, 'Grants'), (105, 'Other')]
+
+# recurring series (subcategory ID, name, interval, typical amount in EUR), repeated while the ledger grows
+RECURRING_SERIES = [
+    (101, 'Salary', 'monthly', 3200), (3, 'Rent', 'monthly', 1100), (5, 'Electricity', 'monthly', 70),
+    (8, 'TV/Phone/Internet', 'monthly', 45), (10, 'Insurance', 'yearly', 600), (12, 'Groceries', 'weekly', 60),
+    (29, 'Pets', 'fortnightly', 30), (102, 'Business', 'monthly', 400),
+]
+INTERVAL_DAYS = {'weekly': 7, 'fortnightly': 14, 'monthly': 30, 'yearly': 365}
+
+# currency mix of the one-off expenses and the synthetic EUR rate of every currency (1 unit = x EUR)
+CURRENCIES = [('EUR', 70, 1.0), ('USD', 15, 0.92), ('GBP', 8, 1.17), ('CHF', 4, 1.04), ('JPY', 2, 0.0062), ('PLN', 1, 0.23)]
+
+def synthetic_rate(currency, day):
+    """Deterministic currency → EUR rate of a day (yyyy-mm-dd): the base rate with a slow +-5% wave."""
+    base = next((rate for code, _, rate in CURRENCIES if code == currency), 1.0)
+    if currency == 'EUR':
+        return 1.0
+    ordinal = Date.fromisoformat(day).toordinal()
+    return round(base * (1 + 0.05 * math.sin(ordinal / 45 + len(currency) * ord(currency[0]))), 6)
+
+def synthetic_rate_series(currency, start, end):
+    """Same result shape as base_calc.fetch_rate_series, business days only, without a network call."""
+    rates = {}
+    day = Date.fromisoformat(start)
+    while day <= Date.fromisoformat(end):
+        if day.weekday() < 5:
+            rates[day.isoformat()] = synthetic_rate(currency, day.isoformat())
+        day += timedelta(days=1)
+    return rates
+
+def sorted_days(rng, count, span):
+    """count random day offsets in 0..span-1 in ascending order, generated one at a time (no list of all days).
+
+    Each value is the smallest of the remaining uniform draws, found from the previous one (Bentley and Saxe).
+    """
+    position = 0.0
+    for remaining in range(count, 0, -1):
+        position += (1 - position) * (1 - rng.random() ** (1 / remaining))
+        yield min(int(position * span), span - 1)
+
+def generate_ledger(database_name, nr_items, nr_years=5, seed=1, quiet=False):
+    """Create (or replace) database_name with about nr_items TransactionItems spread over the last nr_years years.
+
+    Every transaction has one to three paid shares. Recurring series (salary, rent, subscriptions) appear as
+    one-time rows, only the newest row of each series carries the repeat interval, the way the forecast expects it.
+    """
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(database_name + suffix):
+            os.remove(database_name + suffix)
+    conn = sqlite3.connect(database_name)
+    conn.execute("PRAGMA journal_mode = OFF") # one-off bulk load, no rollback needed
+    conn.execute("PRAGMA synchronous = OFF")
+    create_tables(conn)
+
+    conn.executemany("INSERT INTO Categories (categoryID, category) VALUES (?, ?)", [(1, 'Utilities'), (100, 'Income')])
+    conn.executemany("INSERT OR IGNORE INTO Subcategories (subcategoryID, subcategory) VALUES (?, ?)",
+                     [(id_, name) for id_, name, _, _ in EXPENSE_SUBCATEGORIES]
+                     + [(id_, name) for id_, name, _, _ in RECURRING_SERIES] + INCOME_SUBCATEGORIES)
+    conn.executemany('INSERT INTO "Groups" (groupID, "group") VALUES (?, ?)', [(id_, f"Group {id_}") for id_ in GROUP_IDS if id_])
+    conn.executemany("INSERT INTO Users (userID, name) VALUES (?, ?)", [(id_, f"Friend {id_}") for id_ in FRIEND_IDS])
+
+    end = Date.today()
+    start = end - timedelta(days=365 * nr_years)
+    span = (end - start).days
+    subcategories, weights = zip(*[((id_, name, amount), weight) for id_, name, weight, amount in EXPENSE_SUBCATEGORIES])
+    currencies, currency_weights = zip(*[((code, rate), weight) for code, weight, rate in CURRENCIES])
+
+    # recurring rows: (day offset, subcategory ID, description, currency, repeat interval, EUR amount)
+    recurring = []
+    for subcategory_id, name, interval, amount in RECURRING_SERIES:
+        days = list(range(rng.randrange(INTERVAL_DAYS[interval]), span, INTERVAL_DAYS[interval]))
+        for index, day in enumerate(days):
+            repeat = interval if index == len(days) - 1 else 'One-time'
+            recurring.append((day, subcategory_id, name, 'EUR', repeat, amount * rng.uniform(0.97, 1.03)))
+    recurring.sort(key=lambda row: row[0])
+    nr_transactions = max(nr_items // 2, 1) # two paid shares per transaction on average
+    one_off_days = sorted_days(rng, max(nr_transactions - len(recurring), 0), span)
+
+    def transactions_by_day(): #recurring and one-off rows merged in date order, so IDs grow with the date like in Splitwise
+        next_recurring = 0
+        for day in one_off_days:
+            while next_recurring < len(recurring) and recurring[next_recurring][0] <= day:
+                yield recurring[next_recurring]
+                next_recurring += 1
+            subcategory_id, name, amount = rng.choices(subcategories, weights)[0]
+            currency, rate = rng.choices(currencies, currency_weights)[0]
+            yield day, subcategory_id, name, currency, 'One-time', rng.lognormvariate(math.log(amount), 0.6) / rate
+        yield from recurring[next_recurring:]
+
+    transaction_rows = []
+    item_rows = []
+    nr_written = 0
+    for transaction_id, (day, subcategory_id, name, currency, repeat, amount) in enumerate(transactions_by_day(), start=1):
+        day_text = (start + timedelta(days=day)).isoformat()
+        updated = datetime.combine(start + timedelta(days=min(day + rng.randrange(3), span)), datetime.min.time()).isoformat() + "Z"
+        transaction_rows.append((transaction_id, day_text, rng.choice(GROUP_IDS), subcategory_id, name, currency, repeat, updated))
+        rate = synthetic_rate(currency, day_text)
+        shares = 1 if subcategory_id >= 100 else rng.choice((1, 2, 2, 3)) # incomes belong to the user alone
+        users = [USER_ID] + rng.sample(FRIEND_IDS, shares - 1)
+        for user_id in users:
+            share = round(amount / shares, 2)
+            item_rows.append((transaction_id, user_id, share, round(share * rate, 2), updated))
+        if len(item_rows) >= 100000: # write in chunks, so 10M items do not need all rows in memory
+            nr_written += write_chunk(conn, transaction_rows, item_rows)
+    nr_written += write_chunk(conn, transaction_rows, item_rows)
+
+    refresh_monthly_summary(conn)
+    conn.commit()
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+    if not quiet:
+        print(f"Generated {database_name}: {nr_written} transaction items in {time.perf_counter() - started:.1f} s")
+    return database_name
+
+def write_chunk(conn, transaction_rows, item_rows): #writes and empties both buffers, returns the number of items
+    conn.executemany("INSERT INTO Transactions (transactionID, date, groupID, subcategoryID, description, currency, repeatInterval, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", transaction_rows)
+    conn.executemany("INSERT INTO TransactionItems (transactionID, userID, amount, baseAmount, baseUpdated) VALUES (?, ?, ?, ?, ?)", item_rows)
+    nr_items = len(item_rows)
+    transaction_rows.clear()
+    item_rows.clear()
+    return nr_items
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic user database.")
+    parser.add_argument("--items", type=int, default=10000, help="number of TransactionItems, e.g. 10000, 1000000 or 10000000")
+    parser.add_argument("--years", type=int, default=5, help="years of history")
+    parser.add_argument("--seed", type=int, default=1, help="random seed, the same seed gives the same ledger")
+    parser.add_argument("--output", default=None, help="file name (default: ledger_<items>.sqlite)")
+    args = parser.parse_args()
+    generate_ledger(args.output or f"ledger_{args.items}.sqlite", args.items, args.years, args.seed)
@@ -2,8 +2,6 @@ import os
 import sqlite3
 import sync
 from datetime import datetime
-from splitwise import Splitwise
-from requests_oauthlib import OAuth1Session
 
 
 def input_category(conn):
@@ -33,9 +31,9 @@ def input_category(conn):
     conn.commit()
 
 
-def input_data(user_id):
+def input_data(user_id, db_name=None):
     #opens the database or create one if does not exist
-    db_name = f"{user_id}.sqlite"
+    db_name = db_name or f"{user_id}.sqlite"
 
     if not os.path.exists(db_name):
         print(f"Database '{db_name}' not found. Please create it using the sync module first.")
@@ -56,6 +54,7 @@ def input_data(user_id):
     repeat_intervals = ['One-time', 'Weekly', 'Fortnightly', 'Monthly', 'Yearly'] #defines repeated intervals
 
     try:
+        sync.create_tables(conn) #makes sure the schema is up to date
         input_category(conn) #makes sure the categories are in place
         subcategory_id = None
         subcategory_name = None
@@ -83,7 +82,7 @@ def input_data(user_id):
         while True:
             date_input = input("Enter the date (DD.MM.YYYY): ")
             try:
-                date = datetime.strptime(date_input, "%d.%m.%Y").strftime("%d.%m.%Y")
+                date = datetime.strptime(date_input, "%d.%m.%Y").strftime("%Y-%m-%d") #stored as yyyy-mm-dd
                 break
             except ValueError:
                 print("Invalid date format. Please use DD.MM.YYYY.")
@@ -96,15 +95,17 @@ def input_data(user_id):
                 print("Invalid repeat interval. Please try again.")
 
         #inserts the transaction details into the database
+        updated = datetime.now().isoformat()
         cursor.execute('''INSERT INTO Transactions (transactionID, date, groupID, subcategoryID, description, currency, repeatInterval, updated)
                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                       (None, date, None, subcategory_id, subcategory_name, 'EUR', repeat_interval, datetime.now().isoformat()))
+                       (None, date, None, subcategory_id, subcategory_name, 'EUR', repeat_interval, updated))
         transaction_id = cursor.lastrowid
 
-        #inserting transaction items to the database
-        cursor.execute('''INSERT INTO TransactionItems (transactionID, userID, amount, baseAmount)
-                          VALUES (?, ?, ?, ?)''',
-                       (transaction_id, user_id, amount, amount))
+        #inserting transaction items to the database, the base amount is already final (EUR)
+        cursor.execute('''INSERT INTO TransactionItems (transactionID, userID, amount, baseAmount, baseUpdated)
+                          VALUES (?, ?, ?, ?, ?)''',
+                       (transaction_id, user_id, amount, amount, updated))
+        sync.refresh_monthly_summary(conn, [date[:7]])
 
         conn.commit()
         print(f"Income has been added to the database!")
@@ -0,0 +1,128 @@
+# Timed spans and counters for the slow parts of every module: API calls, SQL, pandas, charts and .pdf output.
+# Off by default. PF_TRACE=1 (or PF_TRACE=<file>.json, or personal_finance.py --trace) turns it on; at exit the
+# spans are written as a Chrome trace (open it in chrome://tracing or ui.perfetto.dev) and a summary table is printed.
+# When off, span() returns a shared no-op context manager and count() returns at once.
+
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+DEFAULT_TRACE_FILE = "trace.json"
+
+enabled = False
+trace_file = None
+_events = [] # (name, start, end, thread ID, args), times from time.perf_counter()
+_counters = {}
+_lock = threading.Lock()
+_origin = time.perf_counter() # trace timestamps are relative to the import of this module
+_NULL_SPAN = contextlib.nullcontext()
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        with _lock:
+            _events.append((self.name, self.start, end, threading.get_ident(), self.args))
+        return False
+
+def span(name, **args):
+    """Context manager that records how long its block takes, e.g. with span("sql.write_expenses", rows=10): ..."""
+    if not enabled:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+def traced(name):
+    """Decorator form of span() for whole functions."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with _Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name, value=1):
+    """Add value to a counter, e.g. count("splitwise.retries")."""
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def _count_statement(statement): #sqlite3 trace callback, counts statements by their first keyword
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "EMPTY"
+    count(f"sql.{keyword}")
+
+def watch_connection(conn):
+    """Count every SQL statement of a sqlite3 connection (no effect while disabled)."""
+    if enabled:
+        conn.set_trace_callback(_count_statement)
+    return conn
+
+def enable(path=None):
+    """Turn recording on; the trace is written to path (default trace.json) when the process exits."""
+    global enabled, trace_file
+    if not enabled:
+        atexit.register(finish)
+    enabled = True
+    trace_file = path or DEFAULT_TRACE_FILE
+
+def write_trace(path):
+    """Write all spans and counters recorded so far as Chrome trace JSON."""
+    pid = os.getpid()
+    now = (time.perf_counter() - _origin) * 1e6
+    with _lock:
+        events = [{"name": name, "cat": name.split(".", 1)[0], "ph": "X", "pid": pid, "tid": thread_id,
+                   "ts": (start - _origin) * 1e6, "dur": (end - start) * 1e6, "args": args}
+                  for name, start, end, thread_id, args in _events]
+        events += [{"name": name, "ph": "C", "pid": pid, "ts": now, "args": {"value": value}} for name, value in _counters.items()]
+        counters = dict(_counters)
+    with open(path, "w") as file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"counters": counters}}, file)
+
+def summary():
+    """Rows (name, calls, total s, mean ms, max ms) of every span name, the slowest first."""
+    totals = {}
+    with _lock:
+        for name, start, end, _, _ in _events:
+            calls, total, longest = totals.get(name, (0, 0.0, 0.0))
+            totals[name] = (calls + 1, total + end - start, max(longest, end - start))
+    rows = [(name, calls, total, total / calls * 1000, longest * 1000) for name, (calls, total, longest) in totals.items()]
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+def print_summary():
+    print(f"\n{'Span':<36}{'Calls':>7}{'Total s':>10}{'Mean ms':>10}{'Max ms':>10}")
+    for name, calls, total, mean, longest in summary():
+        print(f"{name:<36}{calls:7d}{total:10.3f}{mean:10.2f}{longest:10.2f}")
+    with _lock:
+        counters = sorted(_counters.items())
+    if counters:
+        print(f"\n{'Counter':<36}{'Value':>7}")
+        for name, value in counters:
+            print(f"{name:<36}{value:7d}")
+
+def finish(): #runs at exit while enabled
+    import multiprocessing
+    if multiprocessing.parent_process() is not None or (not _events and not _counters):
+        return #pool workers inherit the setting, only the main process writes the file
+    write_trace(trace_file)
+    print_summary()
+    print(f"Trace saved as {trace_file}")
+
+_setting = os.environ.get("PF_TRACE", "")
+if _setting and _setting != "0":
+    enable(None if _setting in ("1", "true", "yes") else _setting)
@@ -0,0 +1,103 @@
+# One command line entry point for all tasks. Every subcommand imports its module only when it runs,
+# so light commands (sync --status, income) do not load pandas, numpy, matplotlib or fpdf.
+# Usage: python personal_finance.py <sync|income|base-amounts|fx-refresh|reconcile|predict|report> [options]
+
+import argparse
+import sys
+import instrument
+
+def database_of(args): #--database, otherwise the database of the stored identity (see sync.get_database_name)
+    if args.database:
+        return args.database
+    from sync import get_database_name
+    return get_database_name()
+
+def run_sync(args):
+    import sync
+    if args.status:
+        sync.sync_status(database_of(args))
+    elif args.upgrade:
+        sync.upgrade_databases()
+    elif args.rebuild_summary:
+        sync.rebuild_summaries()
+    else:
+        sync.sync_splitwise_data(quiet=args.quiet)
+
+def run_income(args):
+    import income
+    from sync import get_user_id
+    income.input_data(get_user_id(), args.database)
+
+def run_base_amounts(args):
+    from base_calc import update_base_amounts
+    update_base_amounts(database_of(args), full=args.full, offline=args.offline)
+
+def run_fx_refresh(args):
+    import fx_dataset
+    fx_dataset.refresh_dataset(args.dir or fx_dataset.DATASET_DIR)
+
+def run_reconcile(args):
+    from unrec_transact import unrecorded_transactions
+    unrecorded_transactions(database_of(args))
+
+def run_predict(args):
+    import prediction
+    import unrec_transact
+    fact_balance = args.balance if args.balance is not None else unrec_transact.get_factbalance()
+    prediction.prediction(database_of(args), fact_balance, args.years, args.paths, args.seed, args.sample)
+
+def run_report(args):
+    from reporting import reporting
+    reporting(database_name=args.database, filename=args.output)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="personal-finance", description="Personal finance tools on top of Splitwise.")
+    parser.add_argument("--database", default=None, help="SQLite file to use (default: <user ID>.sqlite of the stored identity)")
+    parser.add_argument("--trace", action="store_true", help="record timings, write them as Chrome trace JSON and print a summary")
+    parser.add_argument("--trace-file", default=instrument.DEFAULT_TRACE_FILE, help="trace file of --trace (default: trace.json)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("sync", help="fetch groups, friends, categories and changed expenses from Splitwise")
+    command.add_argument("--quiet", action="store_true", help="only print errors")
+    command.add_argument("--status", action="store_true", help="show the state of the local database, no Splitwise call")
+    command.add_argument("--upgrade", action="store_true", help="migrate every database in data/ to the current schema")
+    command.add_argument("--rebuild-summary", action="store_true", help="rebuild MonthlySummary in every database in data/")
+    command.set_defaults(handler=run_sync)
+
+    command = commands.add_parser("income", help="enter an income transaction")
+    command.set_defaults(handler=run_income)
+
+    command = commands.add_parser("base-amounts", help="convert transaction amounts to EUR")
+    command.add_argument("--full", action="store_true", help="recalculate every item, not only changed ones")
+    command.add_argument("--offline", action="store_true", help="use the FX dataset (see fx-refresh), no Frankfurter requests")
+    command.set_defaults(handler=run_base_amounts)
+
+    command = commands.add_parser("fx-refresh", help="download the FX rates published since the last refresh")
+    command.add_argument("--dir", default=None, help="dataset folder (default: fx)")
+    command.set_defaults(handler=run_fx_refresh)
+
+    command = commands.add_parser("reconcile", help="record the difference between the ledger and the fact balance")
+    command.set_defaults(handler=run_reconcile)
+
+    command = commands.add_parser("predict", help="forecast the balance and save it as .pdf")
+    command.add_argument("--years", type=int, default=3, help="years to predict")
+    command.add_argument("--balance", type=float, default=None, help="fact balance in EUR (asked for if missing)")
+    command.add_argument("--paths", type=int, default=0, help="Monte Carlo paths for the P5/P50/P95 bands (0: none)")
+    command.add_argument("--seed", type=int, default=None, help="random seed of the Monte Carlo simulation")
+    command.add_argument("--sample", choices=["daily", "month-start", "year-end"], default=None,
+                         help="dates of the plotted balance (default: daily up to 5 years, otherwise every 1st)")
+    command.set_defaults(handler=run_predict)
+
+    command = commands.add_parser("report", help="create the .pdf report of the last three months")
+    command.add_argument("--output", default=None, help="file name of the report (default: <date>.pdf)")
+    command.set_defaults(handler=run_report)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.trace:
+        instrument.enable(args.trace_file)
+    args.handler(args)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
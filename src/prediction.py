@@ -1,32 +1,227 @@
 # Prediction module for the "Personal Finance Project" in Python, by: Tim Döring (68973)
 
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-from datetime import datetime, timedelta
+# forecast() only computes the balance path and has no side effects, render_prediction_pdf() draws it.
+# matplotlib is only imported when a PDF is rendered.
+
+from datetime import datetime
 import pandas as pd
 import sqlite3
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import cache
+import instrument
+from sync import create_tables
 
-def prediction(database_name, fact_balance, nr_years):
-     
-    # nr_years must be a positive integer number
-    
-    if not isinstance(nr_years, int) or nr_years <= 0:
-        print("Error: The number of years must be a positive integer.")
-        return
-    
-    # Limit the prediction period to 5 years max
-    if nr_years > 5:
-        print("Attention: The prediction duration has been limited to 5 years.")
-        nr_years = 5  # Sets nr_years to 5 if the user inputs a number greater than 5
-    
+# Recurrence expansion engine: every recurring transaction becomes an array of day offsets within the prediction window.
+# All dates are handled as numpy datetime64[D] values, months as datetime64[M] values.
+
+INTERVAL_DAYS = {'weekly': 7, 'fortnightly': 14}
+
+def ragged_ranges(first, counts):
+    """For every row i the integers first[i] .. first[i] + counts[i] - 1, returned as (row, value) arrays."""
+    counts = np.maximum(counts, 0)
+    rows = np.repeat(np.arange(len(counts)), counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    values = np.repeat(first, counts) + (np.arange(counts.sum()) - starts)
+    return rows, values
+
+def days_in_month(months):
+    return ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(np.int64)
+
+def expand_fixed_steps(dates, step, start, end):
+    # weekly and fortnightly: date + k * step for k >= 0
+    first_k = np.maximum(0, -((dates - start).astype(np.int64) // step))  # ceil division, only occurrences from the start date on
+    last_k = (end - dates).astype(np.int64) // step
+    rows, k = ragged_ranges(first_k, last_k - first_k + 1)
+    return rows, dates[rows] + k * step
+
+def expand_monthly(dates, start, end):
+    months = dates.astype('datetime64[M]')
+    day = (dates - months.astype('datetime64[D]')).astype(np.int64) + 1
+    # If the day does not exist in a later month (f. ex. the 31st), the amount is inserted on the 28th from then on.
+    # The 28th is chosen as it is the smallest possible month length. Such a month always occurs within 24 months.
+    lookahead = months[:, None] + np.arange(24)
+    too_short = day[:, None] > days_in_month(lookahead)
+    first_short = np.where(too_short.any(axis=1), too_short.argmax(axis=1), np.iinfo(np.int64).max)
+
+    first_k = np.maximum(0, (start.astype('datetime64[M]') - months).astype(np.int64))
+    last_k = (end.astype('datetime64[M]') - months).astype(np.int64)
+    rows, k = ragged_ranges(first_k, last_k - first_k + 1)
+    occurrence_day = np.where(k < first_short[rows], day[rows], 28)
+    return rows, (months[rows] + k).astype('datetime64[D]') + (occurrence_day - 1)
+
+def expand_yearly(dates, start, end):
+    months = dates.astype('datetime64[M]')
+    day = (dates - months.astype('datetime64[D]')).astype(np.int64) + 1
+    month_of_year = months.astype(np.int64) % 12
+    day = np.where((month_of_year == 1) & (day == 29), 28, day)  # February 29th is moved to the 28th (leap years)
+
+    years = dates.astype('datetime64[Y]')
+    first_k = np.maximum(0, (start.astype('datetime64[Y]') - years).astype(np.int64) - 1)
+    last_k = (end.astype('datetime64[Y]') - years).astype(np.int64)
+    rows, k = ragged_ranges(first_k, last_k - first_k + 1)
+    return rows, (months[rows] + 12 * k).astype('datetime64[D]') + (day[rows] - 1)
+
+def expand_recurrences(dates, intervals, start, end):
+    """Occurrences of all recurring transactions between start and end as (row, day offset from start) arrays."""
+    all_rows, all_days = [], []
+    for interval in ('weekly', 'fortnightly', 'monthly', 'yearly'):
+        selected = np.flatnonzero(intervals == interval)
+        if len(selected) == 0:
+            continue
+        if interval in INTERVAL_DAYS:
+            rows, days = expand_fixed_steps(dates[selected], INTERVAL_DAYS[interval], start, end)
+        elif interval == 'monthly':
+            rows, days = expand_monthly(dates[selected], start, end)
+        else:
+            rows, days = expand_yearly(dates[selected], start, end)
+        all_rows.append(selected[rows])
+        all_days.append(days)
+    if not all_rows:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    rows, days = np.concatenate(all_rows), np.concatenate(all_days)
+    inside = (days >= start) & (days <= end)
+    return rows[inside], (days[inside] - start).astype(np.int64)
+
+# Sparse forecast: the future is only kept as dated cash-flow events, balances are derived at the requested sample dates.
+# Memory and time depend on the number of events, not on the number of days in the prediction time frame.
+
+def forecast_events(dates, intervals, amounts, is_income, is_expense, start, end):
+    """Future cash flows as (day offset, signed amount, transaction row) arrays sorted by day. Incomes are positive, expenses negative.
+
+    Weekly, fortnightly and monthly rows count only with an income or expense subcategory. Yearly rows are incomes
+    unless their subcategory is an expense, so rows without a known subcategory are added as well.
+    """
+    rows, day_offsets = expand_recurrences(dates, intervals, start, end)
+    other_sign = np.where(intervals == 'yearly', 1.0, 0.0)
+    sign = np.where(is_expense, -1.0, np.where(is_income, 1.0, other_sign))[rows]
+    keep = sign != 0
+    rows, day_offsets, signed_amounts = rows[keep], day_offsets[keep], (amounts[rows] * sign)[keep]
+    order = np.argsort(day_offsets, kind='stable')
+    return day_offsets[order], signed_amounts[order], rows[order]
+
+def sample_points(start, end, frequency):
+    """Day offsets (from start) of every day ('daily'), every 1st of a month ('month-start') or every December 31st ('year-end')."""
+    if frequency == 'daily':
+        days = np.arange(start, end + 1)
+    elif frequency == 'month-start':
+        days = np.arange(start.astype('datetime64[M]'), end.astype('datetime64[M]') + 1).astype('datetime64[D]')
+    elif frequency == 'year-end':
+        days = (np.arange(start.astype('datetime64[Y]'), end.astype('datetime64[Y]') + 1) + 1).astype('datetime64[D]') - 1
+    else:
+        raise ValueError(f"Unknown sample frequency: {frequency}")
+    days = days[(days >= start) & (days <= end)]
+    return (days - start).astype(np.int64)
+
+def balances_at(event_days, event_amounts, fact_balance, sample_days):
+    """Balance on each sample day: fact_balance plus all events after the first day up to and including that day."""
+    after_first_day = event_days > 0  # fact_balance already includes everything that happens on the first day
+    running_totals = np.concatenate(([0.0], np.cumsum(event_amounts[after_first_day])))
+    return fact_balance + running_totals[np.searchsorted(event_days[after_first_day], sample_days, side='right')]
+
+# Monte Carlo simulation: many possible balance paths instead of one.
+# Recurring amounts vary around their baseAmount, foreign currencies drift against EUR and random one-off expenses
+# are drawn from the history of every subcategory. The result are percentile bands of the balance (P5/P50/P95).
+
+INCOME_VARIATION = 0.05  # standard deviation of a recurring income, relative to its amount
+EXPENSE_VARIATION = 0.10  # standard deviation of a recurring expense, relative to its amount
+FX_VOLATILITY = 0.08  # yearly standard deviation of an exchange rate against EUR
+PATHS_PER_CHUNK = 1000  # paths simulated together as one batch of arrays
+PARALLEL_MIN_PATHS = 5000  # from this number of paths on, the batches are spread across a process pool
+PERCENTILES = (5, 50, 95)
+
+def build_scenario(event_days, event_amounts, event_currencies, history, fact_balance, start, sample_days):
+    """Everything a simulation batch needs, as plain arrays (cheap to send to worker processes).
+
+    Events are summed up per (sample period, currency): a sum of independent normal variations is again normal,
+    so the paths only need one random number per period and currency instead of one per event.
+    history holds the past one-time expenses as a dataframe with 'date', 'subcategoryID' and 'baseAmount' columns.
+    """
+    event_currencies = np.asarray(event_currencies, dtype=str)
+    currencies = np.union1d(event_currencies, ['EUR'])  # EUR is always kept, so there is a column without any recurring event
+    currency_index = np.searchsorted(currencies, event_currencies)
+    after_first_day = event_days > 0  # fact_balance already includes everything that happens on the first day
+    periods = np.searchsorted(sample_days, event_days[after_first_day], side='left')
+    cells = periods * len(currencies) + currency_index[after_first_day]
+    amounts = np.nan_to_num(event_amounts[after_first_day])
+    variation = np.where(amounts > 0, INCOME_VARIATION, EXPENSE_VARIATION) * amounts
+    nr_cells = len(sample_days) * len(currencies)
+    sample_months = ((start + sample_days).astype('datetime64[M]') - start.astype('datetime64[M]')).astype(np.int64)
+
+    # one-off expenses: how often they happened per day and which amounts they had, per subcategory
+    history = history.dropna(subset=['baseAmount'])
+    history_days = max(30, (history['date'].max() - history['date'].min()).days + 1) if len(history) else 1
+    groups = [group['baseAmount'].to_numpy(dtype=float) for _, group in history.groupby('subcategoryID')]
+    return {
+        'fact_balance': fact_balance,
+        'sample_days': sample_days,
+        'sample_months': sample_months,
+        'period_mean': np.bincount(cells, weights=amounts, minlength=nr_cells).reshape(-1, len(currencies)),
+        'period_std': np.sqrt(np.bincount(cells, weights=variation ** 2, minlength=nr_cells)).reshape(-1, len(currencies)),
+        'is_foreign': currencies != 'EUR',
+        'oneoff_rates': np.array([len(amounts) / history_days for amounts in groups]),
+        'oneoff_amounts': np.concatenate(groups) if groups else np.array([]),
+        'oneoff_sizes': np.array([len(amounts) for amounts in groups], dtype=np.int64),
+    }
+
+def simulate_chunk(scenario, nr_paths, seed):
+    """Balance paths of one batch as a (nr_paths, nr_samples) array."""
+    rng = np.random.default_rng(seed)
+    sample_days, sample_months = scenario['sample_days'], scenario['sample_months']
+    nr_samples, nr_currencies = scenario['period_mean'].shape
+
+    # recurring cash flows with normal variation, per path, period and currency
+    flows = scenario['period_mean'] + scenario['period_std'] * rng.standard_normal((nr_paths, nr_samples, nr_currencies))
+
+    # exchange rate drift: a random walk per path and currency with monthly steps (mean factor 1)
+    nr_months = sample_months[-1] + 1
+    walk = np.cumsum(rng.standard_normal((nr_paths, nr_months, nr_currencies)) * np.sqrt(1 / 12), axis=1)
+    years = (np.arange(nr_months) / 12)[None, :, None]
+    fx_factor = np.exp(FX_VOLATILITY * walk - 0.5 * FX_VOLATILITY ** 2 * years)
+    fx_factor[:, :, ~scenario['is_foreign']] = 1.0
+    increments = (flows * fx_factor[:, sample_months, :]).sum(axis=2)
+
+    # random one-off expenses: Poisson number per path and subcategory, uniform day, amount drawn from the history
+    rates, sizes = scenario['oneoff_rates'], scenario['oneoff_sizes']
+    if len(rates) and sample_days[-1] > 0:
+        counts = rng.poisson(rates * sample_days[-1], size=(nr_paths, len(rates)))
+        paths = np.repeat(np.arange(nr_paths), counts.sum(axis=1))
+        subcategories = np.repeat(np.tile(np.arange(len(rates)), nr_paths), counts.ravel())
+        first_amount = np.cumsum(sizes) - sizes
+        picks = first_amount[subcategories] + (rng.random(len(subcategories)) * sizes[subcategories]).astype(np.int64)
+        days = rng.integers(1, sample_days[-1] + 1, size=len(subcategories))
+        np.add.at(increments, (paths, np.searchsorted(sample_days, days, side='left')), -scenario['oneoff_amounts'][picks])
+
+    return scenario['fact_balance'] + np.cumsum(increments, axis=1)
+
+@instrument.traced("forecast.monte_carlo")
+def simulate_paths(scenario, nr_paths, seed=None, max_workers=None):
+    """Simulate nr_paths balance paths in batches, in a process pool for large numbers of paths."""
+    sizes = [min(PATHS_PER_CHUNK, nr_paths - first) for first in range(0, nr_paths, PATHS_PER_CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))  # independent random streams per batch
+    if nr_paths >= PARALLEL_MIN_PATHS and len(sizes) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            chunks = list(pool.map(simulate_chunk, repeat(scenario), sizes, seeds))
+    else:
+        chunks = [simulate_chunk(scenario, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+    return np.concatenate(chunks)
+
+def percentile_bands(paths):
+    """P5, P50 and P95 of the simulated balances for every sample date."""
+    return dict(zip([f"P{p}" for p in PERCENTILES], np.percentile(paths, PERCENTILES, axis=0)))
+
+DENSE_MAX_YEARS = 5  # up to this many years the balance is plotted for every day, longer predictions are sampled on the 1st of every month
+SAMPLE_FREQUENCIES = ('daily', 'month-start', 'year-end')
+MAX_YEARS = 100
+
+@instrument.traced("pandas.load_transactions")
+def load_transactions(database_name):
     # Database connection, database_name is the first input argument of the prediction fucntion
     # Import of necessary tables from the database
     
     conn = sqlite3.connect(database_name)
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = cursor.fetchall()
+    create_tables(conn) # Makes sure the dates are stored as yyyy-mm-dd
     Transactions = pd.read_sql_query(f"SELECT * FROM {'Transactions'}", conn)
     TransactionItems = pd.read_sql_query(f"SELECT * FROM {'TransactionItems'}", conn)
     Subcategories = pd.read_sql_query(f"SELECT * FROM {'Subcategories'}", conn)
@@ -41,12 +236,47 @@ def prediction(database_name, fact_balance, nr_years):
     # Creating a dataframe with the necessary columns for all transactions
     
     transactions = pd.DataFrame()
-    transactions['date'] = transactions_merge['date']
-    transactions['date'] = pd.to_datetime(Transactions['date'], format='%d.%m.%Y')
+    transactions['date'] = pd.to_datetime(transactions_merge['date'], format='%Y-%m-%d')
     transactions['description'] = transactions_merge['description']
     transactions['subcategoryID'] = transactions_merge['subcategoryID']
     transactions['repeatInterval'] = transactions_merge['repeatInterval'].str.lower()
     transactions['baseAmount'] = transactions_merge['baseAmount']
+    transactions['currency'] = transactions_merge['currency'].fillna('EUR')
+    return transactions, Subcategories
+
+def forecast(database_name, fact_balance, nr_years, nr_paths=0, seed=None, use_cache=True, sample=None):
+    """Compute the predicted balance without plotting or writing files.
+
+    sample chooses the dates of 'balance': 'daily', 'month-start' or 'year-end' (start and end date are always
+    included). Without it, predictions up to DENSE_MAX_YEARS are sampled daily and longer ones on every 1st.
+    Returns a dict with the dataframes 'balance' (date, balance of every sample date), 'table' (date, balance and
+    P5/P50/P95 for the start, end and 1st of every month) and 'bands' (date, P5, P50, P95 or None without nr_paths).
+    Results are reused from the cache while the ledger and the parameters (and the day) stay the same.
+    """
+
+    # Monte Carlo runs without a seed are random, so they are never taken from the cache
+    if use_cache and (nr_paths == 0 or seed is not None):
+        params = {'fact_balance': fact_balance, 'nr_years': nr_years, 'nr_paths': nr_paths, 'seed': seed,
+                  'sample': sample, 'today': datetime.today().strftime('%Y-%m-%d')}
+        return cache.cached(database_name, 'forecast', params,
+                            lambda: forecast(database_name, fact_balance, nr_years, nr_paths, seed, use_cache=False, sample=sample))
+     
+    # nr_years must be a positive integer number
+    
+    if not isinstance(nr_years, int) or nr_years <= 0:
+        print("Error: The number of years must be a positive integer.")
+        return None
+    
+    # Limit the prediction period to 100 years max
+    if nr_years > MAX_YEARS:
+        print(f"Attention: The prediction duration has been limited to {MAX_YEARS} years.")
+        nr_years = MAX_YEARS
+
+    if sample is not None and sample not in SAMPLE_FREQUENCIES:
+        print(f"Error: The sample frequency must be one of {', '.join(SAMPLE_FREQUENCIES)}.")
+        return None
+
+    transactions, Subcategories = load_transactions(database_name)
 
     # Setting the time frame for the prediction
     
@@ -57,119 +287,72 @@ def prediction(database_name, fact_balance, nr_years):
     except ValueError:  # If the code is run on a February 29th, the prediction ends on February 28th of the selected future year.
         prediction_end_date = prediction_start_date.replace(year=prediction_start_date.year + nr_years, day=28)
 
-    # Creating an object with all the dates within the prediction time frame
-    
-    future_dates = pd.date_range(start=prediction_start_date, end=prediction_end_date, freq='D')
-    future_dates = future_dates.strftime("%d.%m.%Y")
-
-    # Creating a dataframe with all the future dates as rows and the necessary columns to predict a balance for each date
-    
-    prediction = pd.DataFrame()
-    prediction['date'] = future_dates
-    prediction['date'] = pd.to_datetime(prediction['date'], format='%d.%m.%Y')
-    prediction['incomes'] = [0] * len(future_dates)
-    prediction['expenses'] = [0] * len(future_dates)
-    prediction['balance'] = [0] * len(future_dates)
-    
-    # Setting type to "float" for the columns that will be including monetary values
-    prediction['expenses'] = prediction['expenses'].astype(float)
-    prediction['incomes'] = prediction['incomes'].astype(float)
-    prediction['balance'] = prediction['balance'].astype(float)  
-
-    # Creating two lists with subcategory IDs based on whether they are incomes or expenses.
-    # All expense subcatogry IDs are between 1 and 99, all income subcategory IDs above 100.
-    
-    expenses = []
-    incomes = []
-
-    for i in range(len(Subcategories)):
-        subcategoryID = Subcategories.iloc[i]['subcategoryID']
-        
-        if 1 <= subcategoryID <= 99:
-            expenses.append(subcategoryID)
-        elif 100 <= subcategoryID <= 200:
-            incomes.append(subcategoryID)
-
-    # Inserting transactions row by row based on their "repeatInterval" category.
-    
-    for _, row in transactions.iterrows():
-        transaction_date = row['date']
-        subcategoryID = row['subcategoryID']
-        baseAmount = row['baseAmount']
-        repeatInterval = row['repeatInterval']
-
-        # Inserting "weekly" transaction amounts into the prediction dataframe
-        
-        if repeatInterval == 'weekly':
-            while transaction_date <= prediction['date'].max():
-                if transaction_date in prediction['date'].values:
-                    index = prediction.index[prediction['date'] == transaction_date][0]
-                    if subcategoryID in expenses:
-                        prediction.loc[index, 'expenses'] += baseAmount
-                    elif subcategoryID in incomes:
-                        prediction.loc[index, 'incomes'] += baseAmount
-                        
-                transaction_date += timedelta(weeks=1)
-
-        # Inserting "fortnightly" transaction amounts into the prediction dataframe
-        
-        elif repeatInterval == 'fortnightly':
-            while transaction_date <= prediction['date'].max():
-                if transaction_date in prediction['date'].values:
-                    index = prediction.index[prediction['date'] == transaction_date][0]
-                    if subcategoryID in expenses:
-                        prediction.loc[index, 'expenses'] += baseAmount
-                    elif subcategoryID in incomes:
-                        prediction.loc[index, 'incomes'] += baseAmount
-                        
-                transaction_date += timedelta(weeks=2)
-
-        # Inserting "monthly" transaction amounts into the prediction dataframe
-
-        elif repeatInterval == 'monthly':
-            while transaction_date <= prediction['date'].max():
-                if transaction_date in prediction['date'].values:
-                    index = prediction.index[prediction['date'] == transaction_date][0]
-                    if subcategoryID in expenses:
-                        prediction.loc[index, 'expenses'] += baseAmount
-                    elif subcategoryID in incomes:
-                        prediction.loc[index, 'incomes'] += baseAmount
-        
-                next_month = transaction_date.month + 1 if transaction_date.month < 12 else 1
-                next_year = transaction_date.year if transaction_date.month < 12 else transaction_date.year + 1
-                
-                try:
-                    transaction_date = transaction_date.replace(year=next_year, month=next_month)
-                # If transaction date is f. ex. the 31st and the next month has fewer days, the amount is inserted on the 28th. 
-                # The 28th is chosen as it is the smallest possible month length.
-                except ValueError: 
-                    transaction_date = transaction_date.replace(year=next_year, month=next_month, day=28)
-        
-        # Inserting "yearly" transaction amounts into the prediction dataframe
-
-        elif repeatInterval == 'yearly':
-            while transaction_date <= prediction['date'].max():
-                # Adjust for February 29th (in case of leap year)
-                if transaction_date.month == 2 and transaction_date.day == 29:
-                    transaction_date = transaction_date.replace(day=28)
-                
-                if transaction_date in prediction['date'].values:
-                    index = prediction.index[prediction['date'] == transaction_date][0]
-                    column = 'expenses' if subcategoryID in expenses else 'incomes'
-                    prediction.loc[index, column] += baseAmount
-        
-                transaction_date = transaction_date.replace(year=transaction_date.year + 1)
-
-    # Calculating every row of the balance column of the prediction dataframe
-    
-    prediction.loc[0, 'balance'] = fact_balance # fact_balance as the start for the prediction (first row). fact_balance is an input argument.
-    
-    # predicted balance is the predicted balance of the day before plus all repeated incomes and minus all repeated expenses occuring that day.
-    for i in range(1, len(prediction)): 
-        prediction.loc[i, 'balance'] = (
-            prediction.loc[i - 1, 'balance'] + prediction.loc[i, 'incomes'] - prediction.loc[i, 'expenses'])
+    start = np.datetime64(prediction_start_date.date(), 'D')
+    end = np.datetime64(prediction_end_date.date(), 'D')
+
+    # Subcategory IDs decide whether an amount is an income or an expense.
+    # All expense subcatogry IDs are between 1 and 99, all income subcategory IDs above 100 (only IDs of the Subcategories table count).
+
+    known_ids = Subcategories['subcategoryID'].to_numpy()
+    subcategory_ids = transactions['subcategoryID'].to_numpy(dtype=float)
+    is_known = np.isin(subcategory_ids, known_ids)
+    is_expense = is_known & (subcategory_ids >= 1) & (subcategory_ids <= 99)
+    is_income = is_known & (subcategory_ids >= 100) & (subcategory_ids <= 200)
+
+    # Expanding every recurring transaction into its dates within the time frame (cash-flow events)
+
+    event_days, event_amounts, event_rows = forecast_events(
+        transactions['date'].to_numpy().astype('datetime64[D]'),
+        transactions['repeatInterval'].to_numpy(dtype=object),
+        transactions['baseAmount'].to_numpy(dtype=float),
+        is_income, is_expense, start, end)
+
+    # fact_balance is the start of the prediction (first day). fact_balance is an input argument.
+    # predicted balance is the balance of the first day plus all repeated incomes and minus all repeated expenses up to that day.
+    # Balances are only calculated for the sample dates: the requested ones, otherwise every day for short predictions
+    # and the 1st of every month for long ones.
+
+    dense = nr_years <= DENSE_MAX_YEARS
+    plot_days = sample_points(start, end, sample or ('daily' if dense else 'month-start'))
+    plot_days = np.union1d(plot_days, [0, (end - start).astype(np.int64)])  # start and end date are always included
+    prediction = pd.DataFrame({
+        'date': pd.to_datetime(start + plot_days),
+        'balance': balances_at(event_days, event_amounts, fact_balance, plot_days)})
+
+    # Selected rows for the table: start and end date as well as all 1st days of every month (every December 31st for long predictions)
+
+    table_days = sample_points(start, end, 'month-start' if dense else 'year-end')
+    table_days = table_days[(table_days > 0) & (table_days < (end - start).astype(np.int64))]
+    table_days = np.concatenate(([0], table_days, [(end - start).astype(np.int64)]))
+    prediction_selection = pd.DataFrame({
+        'date': pd.to_datetime(start + table_days),
+        'balance': balances_at(event_days, event_amounts, fact_balance, table_days)})
+
+    # Monte Carlo simulation on the 1st of every month (and the table dates), only if paths were requested
+
+    bands = None
+    if nr_paths > 0:
+        band_days = np.union1d(sample_points(start, end, 'month-start'), table_days)
+        history = transactions[(transactions['repeatInterval'] == 'one-time') & is_expense]
+        scenario = build_scenario(event_days, event_amounts, transactions['currency'].to_numpy()[event_rows],
+                                  history, fact_balance, start, band_days)
+        percentiles = percentile_bands(simulate_paths(scenario, nr_paths, seed))
+        bands = pd.DataFrame({'date': pd.to_datetime(start + band_days), **percentiles})
+        for name, values in percentiles.items():
+            prediction_selection[name] = values[np.searchsorted(band_days, table_days)]
+        print(f"Simulated {nr_paths} balance paths")
+
+    return {'balance': prediction, 'table': prediction_selection, 'bands': bands}
+
+@instrument.traced("pdf.prediction")
+def render_prediction_pdf(result, filename=None):
+    """Draw the result of forecast() as plot and table into a .pdf file, returns the file name."""
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    prediction, bands = result['balance'], result['bands']
+    prediction_selection = result['table'].copy()
 
-    
     # Creation of the prediction plot
     # x-axis labels on start and end date as well as the same days as the start date in every future year.
     
@@ -189,24 +372,24 @@ def prediction(database_name, fact_balance, nr_years):
     
     plt.figure(figsize=(12, 6))
     plt.plot(prediction['date'], prediction['balance'], color='red', label='Predicted Balance')
+    if bands is not None:
+        plt.fill_between(bands['date'], bands['P5'], bands['P95'], color='red', alpha=0.15, label='P5 - P95 (Monte Carlo)')
+        plt.plot(bands['date'], bands['P50'], color='darkred', linestyle='--', label='P50 (Monte Carlo)')
     plt.xticks(x_axis_labels, [date.strftime('%d.%m.%Y') for date in x_axis_labels], rotation=45)
     plt.xlabel('Date')
     plt.ylabel('Balance')
     plt.title('Prediction of the Balance Over Time')
     plt.legend()
 
-    # Creation of a prediction dataframe with selected rows (start and end date as well as all 1st days of every month)
+    # Formatting the selected rows for the table
     
-    prediction_start = prediction[['date', 'balance']].iloc[[0]]
-    first_of_every_month = prediction[['date', 'balance']][prediction['date'].dt.day == 1]
-    prediction_end = prediction[['date', 'balance']].iloc[[-1]]
-    prediction_selection = pd.concat([prediction_start,  first_of_every_month, prediction_end])
     prediction_selection['date'] = prediction_selection['date'].dt.strftime('%d.%m.%Y')
-    prediction_selection['balance'] = prediction_selection['balance'].round(2)
+    prediction_selection = prediction_selection.round(2)
 
     # Creating the .pdf file
-    current_time = datetime.now().strftime('%Y-%m-%d_%H-%M')
-    filename = f"{current_time}_prediction.pdf"
+    if filename is None:
+        current_time = datetime.now().strftime('%Y-%m-%d_%H-%M')
+        filename = f"{current_time}_prediction.pdf"
     
     with PdfPages(filename) as pdf:
         plt.tight_layout()
@@ -238,9 +421,27 @@ def prediction(database_name, fact_balance, nr_years):
     
         pdf.savefig(fig)
         plt.close()
-        plt.show()
 
     
     print(f"Your .pdf file has been created and saved as: {filename}")
+    return filename
+
+def prediction(database_name, fact_balance, nr_years, nr_paths=0, seed=None, sample=None):
+    # Forecast and .pdf file in one call. nr_paths > 0 adds a Monte Carlo simulation shown as percentile bands (P5/P50/P95)
+    result = forecast(database_name, fact_balance, nr_years, nr_paths, seed, sample=sample)
+    if result is None:
+        return None
+    return render_prediction_pdf(result)
 
-prediction("98754612.sqlite", 18000, 3)
\ No newline at end of file
+if __name__ == "__main__":
+    import unrec_transact
+    from sync import get_database_name
+    database_name = get_database_name() # no Splitwise call once the identity is stored
+    fact_balance = unrec_transact.factbalance if unrec_transact.factbalance is not None else unrec_transact.get_factbalance()
+    while True:
+        try:
+            nr_years = int(input("Enter the number of years for the prediction: "))
+            break
+        except ValueError:
+            print("Invalid input. Please enter a positive integer number.")
+    prediction(database_name, fact_balance, nr_years)
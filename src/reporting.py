@@ -1,118 +1,184 @@
-import matplotlib.pyplot as plt
 import pandas as pd
 from fpdf import FPDF
+from io import BytesIO
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from sync import get_user_id
-import numpy as np
-# connecting to the db and create df
-def prepare_transactions(user_id):
-    conn = sqlite3.connect(f"{user_id}.sqlite")
-    query = """
+from sync import create_tables, get_user_id
+import cache
+import instrument
+
+REPORT_MONTHS = 3 # the report covers the last three months with transactions
+
+# rows of the MonthlySummary rollup (see sync.refresh_monthly_summary) shown in the report:
+# only positive shares of transactions with a known subcategory
+SUMMARY_JOIN = """
+    FROM MonthlySummary
+    JOIN Subcategories ON MonthlySummary.subcategoryID = Subcategories.subcategoryID
+    WHERE MonthlySummary.positiveItems > 0
+"""
+
+def report_start_month(conn, nr_months=REPORT_MONTHS):
+    # oldest of the last nr_months months with transactions (yyyy-mm)
+    rows = conn.execute(f"""
+        SELECT DISTINCT MonthlySummary.month {SUMMARY_JOIN}
+        ORDER BY MonthlySummary.month DESC LIMIT ?
+    """, (nr_months,)).fetchall()
+    return rows[-1][0] if rows else None
+
+# connecting to the db and create df with totals per month, type and subcategory (read from the monthly rollup)
+@instrument.traced("pandas.prepare_transactions")
+def prepare_transactions(user_id, database_name=None):
+    conn = sqlite3.connect(database_name or f"{user_id}.sqlite")
+    create_tables(conn) # older databases get their MonthlySummary filled here
+    start = report_start_month(conn)
+    query = f"""
     SELECT 
-        Transactions.transactionID,
-        Transactions.date,
-        Transactions.subcategoryID,
-        TransactionItems.baseAmount AS amount,
-        Subcategories.subcategory AS Subcategory
-    FROM Transactions
-    JOIN TransactionItems ON Transactions.transactionID = TransactionItems.transactionID
-    JOIN Subcategories ON Transactions.subcategoryID = Subcategories.subcategoryID
-    WHERE TransactionItems.amount > 0
-    ORDER BY Transactions.date
+        MonthlySummary.month AS month,
+        MonthlySummary.type AS type,
+        Subcategories.subcategory AS Subcategory,
+        MonthlySummary.positiveTotal AS amount
+    {SUMMARY_JOIN}
+    AND MonthlySummary.month >= ?
+    ORDER BY month DESC
     """
-    df = pd.read_sql_query(query, conn)
+    df = pd.read_sql_query(query, conn, params=(start or "",)) # missing base amounts are counted as 0
     conn.close()
-
-    df['date'] = pd.to_datetime(df['date'], format='%d.%m.%Y')
-    df['month'] = df['date'].dt.to_period('M').astype(str)  # new column for month
-    df = df.sort_values('date', ascending=False)
-    df['type'] = np.where((df['subcategoryID'] >= 101) & (df['subcategoryID'] <= 106), 'Income', 'Expense') # new column, assign type of transaction: income or expense
-    df['amount'] = df['amount'].fillna(0) # fill NA with 0
     return df
 
-import matplotlib.pyplot as plt
-import pandas as pd
+# A report has at most 2 + REPORT_MONTHS charts, which render faster one after another than a new process pool
+# starts (every worker imports pandas, matplotlib and fpdf again). Only much longer job lists use a pool.
+PARALLEL_MIN_CHARTS = 24
+
+def reusable_figure(figures, figsize):
+    # one figure per size, reused by all charts of the same shape within one generate_charts call
+    fig = figures.get(figsize)
+    if fig is None:
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig) # Agg backend, no GUI or display needed
+        figures[figsize] = fig
+    else:
+        fig.clear()
+    return fig
+
+def figure_to_png(fig, **savefig_options): # render a figure into PNG bytes in memory (no files on disk)
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", **savefig_options)
+    return buffer.getvalue()
+
+# Every chart is described by a small payload of plain data (lists, strings), so it can be sent to another process.
+def chart_jobs(df):
+    """List of (name, payload) for all charts of the report: two bar charts and one expense pie chart per month."""
+    jobs = []
+    df_monthly = df.groupby(['month', 'type'])['amount'].sum().unstack()  # expenses and income by mponths
+    last3months = df_monthly.tail(3).fillna(0)  # last three months, fill Na with 0
+    jobs.append(('income_vs_expenses', {
+        'kind': 'bar', 'title': 'Income vs Expenses (Last 3 Months)', 'xlabel': 'Month', 'legend': "Type",
+        'index': list(last3months.index), 'columns': list(last3months.columns), 'values': last3months.values.tolist()}))
+    summary = df_monthly.sum() # total expenses and income for last 3 months
+    jobs.append(('total_income_vs_expenses', {
+        'kind': 'bar', 'title': 'Total Income vs Expenses (Last 3 Months)', 'xlabel': 'Type', 'legend': None,
+        'index': list(summary.index), 'columns': None, 'values': summary.values.tolist()}))
+
+    for month in sorted(df['month'].unique()): # for every month of the report, create pie chart
+        monthly_expenses = df[(df['type'] == 'Expense') & (df['month'] == month)] # df with expenses and months
+        if not monthly_expenses.empty:
+            subcategory_data = monthly_expenses.groupby('Subcategory')['amount'].sum() #sum of expenses for every category
+            total = subcategory_data.sum() # sum of all expenses
+            threshold = 0.02 * total # 2% of expenses
+            significant_subcategories = subcategory_data[subcategory_data >= threshold] # we want to have expenses categories, with sum bigger than 2% of total
+            small_subcategories = subcategory_data[subcategory_data < threshold] # rest of expenses categories, less than 2%
+
+            if not small_subcategories.empty:
+                significant_subcategories['Others'] = small_subcategories.sum() # sum of small categories in Others, and add to big categories
+            jobs.append((f'expense_pie_{month}', {
+                'kind': 'pie', 'title': f'Expenses by Subcategory - {month}', 'month': month, 'total': float(total),
+                'labels': list(significant_subcategories.index), 'values': significant_subcategories.values.tolist()}))
+    return jobs
+
+@instrument.traced("charts.render")
+def render_chart(payload, figures=None):
+    """Draw one chart payload and return it as PNG bytes (None if it fails).
 
-# function for visualization
-def generate_charts(df):
+    figures holds the reusable figures of the caller; without it the chart gets its own (e.g. in pool workers).
+    """
+    figures = {} if figures is None else figures
     try:
-        df_monthly = df.groupby(['month', 'type'])['amount'].sum().unstack()  # expenses and income by mponths
-        last3months = df_monthly.tail(3).fillna(0)  # last three months, fill Na with 0
-
-        plt.figure(figsize=(6, 4))  # size of bar chart
-        last3months.plot(kind='bar', color=['red', 'green']) # 1 bar chart Income vs Expenses grouped by months, last 3
-        plt.title('Income vs Expenses (Last 3 Months)')
-        plt.xlabel('Month')
-        plt.ylabel('Amount (€)')
-        plt.xticks(rotation=0) # horizontal label
-        plt.legend(title="Type")
-        plt.tight_layout() # adjusts elements, should prevent overlapping
-        plt.savefig("income_vs_expenses_last_3_months.png") # save 1 bar chart
-        plt.close()
+        if payload['kind'] == 'bar':
+            fig = reusable_figure(figures, (6, 4))  # size of bar chart
+            ax = fig.subplots()
+            if payload['columns'] is None: # one bar per index entry
+                data = pd.Series(payload['values'], index=payload['index'])
+            else: # bars grouped by index entry
+                data = pd.DataFrame(payload['values'], index=payload['index'], columns=payload['columns'])
+            data.plot(kind='bar', color=['red', 'green'], ax=ax)
+            ax.set_title(payload['title'])
+            ax.set_xlabel(payload['xlabel'])
+            ax.set_ylabel('Amount (€)')
+            ax.tick_params(axis='x', labelrotation=0) # horizontal label
+            if payload['legend']:
+                ax.legend(title=payload['legend'])
+            fig.tight_layout() # adjusts elements, should prevent overlapping
+            return figure_to_png(fig)
+
+        fig = reusable_figure(figures, (10, 6))
+        ax = fig.subplots()
+        wedges, texts, autotexts = ax.pie(payload['values'], labels=payload['labels'],
+                                          autopct='%1.1f%%', startangle=90) # creating pie charts, assigns the index of sign. subcat. as labels,str percentage for slices, startby 90 degrees
+        ax.set_title(payload['title']) # title
+        legend_labels = [f'{label}: {value / payload["total"] * 100:.1f}%' for label, value in zip(payload['labels'], payload['values'])] # legend, loop to show subcategory and its percentage of  total exp
+        ax.legend(wedges, legend_labels, title="Subcategories", loc="center left", bbox_to_anchor=(1.2, 0.5))
+        fig.subplots_adjust(right=0.8)
+        return figure_to_png(fig, bbox_inches='tight') # pie chart,all element included
     except Exception as e:
-        print("Failed to generate or save the income vs expenses bar chart:", e)
-    finally:
-        plt.close()
+        print(f"Failed to generate the chart '{payload['title']}':", e)
+        return None
+
+# function for visualization, returns {'income_vs_expenses': png, 'total_income_vs_expenses': png, 'expense_pie': {month: png}}
+# Charts are rendered one after another in this process; from PARALLEL_MIN_CHARTS charts on (or with max_workers > 1)
+# they are spread across a process pool. max_workers=1 always renders serially.
+@instrument.traced("charts.generate")
+def generate_charts(df, max_workers=None):
+    jobs = chart_jobs(df)
+    payloads = [payload for _, payload in jobs]
+    parallel = max_workers > 1 if max_workers is not None else len(jobs) >= PARALLEL_MIN_CHARTS
+    if parallel:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            images = list(pool.map(render_chart, payloads)) # results come back in the order of the jobs
+    else:
+        figures = {} # figures of this call only, so concurrent calls in threads never share one
+        images = [render_chart(payload, figures) for payload in payloads]
+
+    charts = {'expense_pie': {}}
+    for (name, payload), image in zip(jobs, images):
+        if image is None:
+            continue
+        if payload['kind'] == 'pie':
+            charts['expense_pie'][payload['month']] = BytesIO(image)
+        else:
+            charts[name] = BytesIO(image)
+    return charts
 
-    try:
-        plt.figure(figsize=(6, 4))
-        summary = df_monthly.sum() # total expenses and income for last 3 months
-        summary.plot(kind='bar', color=['red', 'green'])
-        plt.title('Total Income vs Expenses (Last 3 Months)')
-        plt.xlabel('Type')
-        plt.ylabel('Amount (€)')
-        plt.xticks(rotation=0)
-        plt.tight_layout() # adjust elements
-        plt.savefig("total_income_vs_expenses.png")
-        plt.close()
-    except Exception as e:  # handle errors
-        print("Failed to generate or save the total income vs expenses bar chart:", e)
-    finally:
-        plt.close()
-
-    months_3 = sorted(df['month'].unique())[-3:] # last three months names
-    for month in months_3: # for every month in last three months, create pie chart
-        try:
-            monthly_expenses = df[(df['type'] == 'Expense') & (df['month'] == month)] # df with expenses and months
-            if not monthly_expenses.empty:
-                subcategory_data = monthly_expenses.groupby('Subcategory')['amount'].sum() #sum of expenses for every category
-                total = subcategory_data.sum() # sum of all expenses
-                threshold = 0.02 * total # 2% of expenses
-                significant_subcategories = subcategory_data[subcategory_data >= threshold] # we want to have expenses categories, with sum bigger than 2% of total
-                small_subcategories = subcategory_data[subcategory_data < threshold] # rest of expenses categories, less than 2%
-
-                if not small_subcategories.empty:
-                    significant_subcategories['Others'] = small_subcategories.sum() # sum of small categories in Others, and add to big categories
-
-                plt.figure(figsize=(10, 6))
-                wedges, texts, autotexts = plt.pie(significant_subcategories, labels=significant_subcategories.index,
-                                                   autopct='%1.1f%%', startangle=90) # creating pie charts, assigns the index of sign. subcat. as labels,str percentage for slices, startby 90 degrees
-                plt.title(f'Expenses by Subcategory - {month}') # title
-                legend_labels = [f'{label}: {val:.1f}%' for label, val in (significant_subcategories / total * 100).items()] # legend, loop to show subcategory and its percentage of  total exp
-                plt.legend(wedges, legend_labels, title="Subcategories", loc="center left", bbox_to_anchor=(1.2, 0.5))
-                plt.subplots_adjust(right=0.8)
-                plt.savefig(f"expense_pie_{month}.png", bbox_inches='tight') # save pie chart,all element included
-        except Exception as e:
-            print(f"Failed to generate or save the pie chart for {month}:", e)
-        finally:
-            plt.close()
 # Creating pdf file with fpdf
-def generate_pdf_report(df):
+@instrument.traced("pdf.report")
+def generate_pdf_report(df, charts, user_id=None, filename=None):
     pdf = FPDF() # instance of Fpdf, create pdf
     pdf.set_auto_page_break(auto=True, margin=15) # breaks autom., margin 15
     pdf.add_page()
-    pdf.set_font("Arial", 'B', 16) # fons sets
-    pdf.cell(0, 10, "Financial Report", ln=1, align="C") # title, centered
+    pdf.set_font("Helvetica", 'B', 16) # fons sets
+    pdf.cell(0, 10, "Financial Report", new_x="LMARGIN", new_y="NEXT", align="C") # title, centered
 
-    user_id = get_user_id() # function from sync module
-    pdf.set_font("Arial", size=12)
-    pdf.cell(0, 10, f"User ID: {user_id}", ln=1) # print user id
+    if user_id is None:
+        user_id = get_user_id() # function from sync module
+    pdf.set_font("Helvetica", size=12)
+    pdf.cell(0, 10, f"User ID: {user_id}", new_x="LMARGIN", new_y="NEXT") # print user id
 
     # Income vs Expenses overview monthly
-    pdf.set_font("Arial", 'B', 14)
-    pdf.cell(0, 10, "Income vs Expenses (Last 3 Months)", ln=1)
-    pdf.set_font("Arial", size=12)
+    pdf.set_font("Helvetica", 'B', 14)
+    pdf.cell(0, 10, "Income vs Expenses (Last 3 Months)", new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font("Helvetica", size=12)
 
     for month_str in sorted(df['month'].unique())[-3:]: # iterates last 3 month
         month = pd.Period(month_str)
@@ -120,16 +186,16 @@ def generate_pdf_report(df):
         monthly_data = df[df['month'] == month_str] # filter for month
         income = monthly_data[monthly_data['type'] == 'Income']['amount'].sum() # sum income
         expenses = monthly_data[monthly_data['type'] == 'Expense']['amount'].sum() # sum expenses
-        pdf.cell(0, 10, f"{formatted_month}: Income: {income:.2f} EUR, Expenses: {expenses:.2f} EUR", ln=1)
+        pdf.cell(0, 10, f"{formatted_month}: Income: {income:.2f} EUR, Expenses: {expenses:.2f} EUR", new_x="LMARGIN", new_y="NEXT")
 # bar charts
-    pdf.set_font("Arial", 'B', 14)
-    pdf.cell(0, 10, "Income & Expense Overview", ln=1, align="C")
-    pdf.set_font("Arial", size=12)
-    try:
-        pdf.image("income_vs_expenses_last_3_months.png", x=10, y=None, w=120) # group by month
-        pdf.image("total_income_vs_expenses.png", x=10, y=None, w=120) # totals last 3 months
-    except FileNotFoundError:
-        pdf.cell(0, 10, "Charts not found.", ln=1)
+    pdf.set_font("Helvetica", 'B', 14)
+    pdf.cell(0, 10, "Income & Expense Overview", new_x="LMARGIN", new_y="NEXT", align="C")
+    pdf.set_font("Helvetica", size=12)
+    if 'income_vs_expenses' in charts and 'total_income_vs_expenses' in charts:
+        pdf.image(charts['income_vs_expenses'], x=10, y=None, w=120) # group by month
+        pdf.image(charts['total_income_vs_expenses'], x=10, y=None, w=120) # totals last 3 months
+    else:
+        pdf.cell(0, 10, "Charts not found.", new_x="LMARGIN", new_y="NEXT")
 
 # pie charts monthly expenses
     last_3_months = sorted(df['month'].unique())[-3:] # list of months
@@ -137,15 +203,14 @@ def generate_pdf_report(df):
         month = pd.Period(month_str)
         formatted_month = month.strftime('%B %Y')
         pdf.add_page()
-        pdf.set_font("Arial", 'B', 14)
-        pdf.cell(0, 10, f"Financial Details - {formatted_month}", ln=1, align="C")
-        pdf.set_font("Arial", size=12)
+        pdf.set_font("Helvetica", 'B', 14)
+        pdf.cell(0, 10, f"Financial Details - {formatted_month}", new_x="LMARGIN", new_y="NEXT", align="C")
+        pdf.set_font("Helvetica", size=12)
 
-        try:
-            pdf.image(f"expense_pie_{month_str}.png", x=10, y=None, w=180)  # Larger chart
-
-        except FileNotFoundError:
-            pdf.cell(0, 10, "Pie Chart not found.", ln=1)
+        if month_str in charts['expense_pie']:
+            pdf.image(charts['expense_pie'][month_str], x=10, y=None, w=180)  # Larger chart
+        else:
+            pdf.cell(0, 10, "Pie Chart not found.", new_x="LMARGIN", new_y="NEXT")
 
 # Print expenses by category with percentage
         monthly_expenses = df[(df['type'] == 'Expense') & (df['month'] == month_str)] # only expenses and month
@@ -155,28 +220,49 @@ def generate_pdf_report(df):
             subcategory_summary['Percentage'] = (subcategory_summary['amount'] / total_amount) * 100 # persentage for categories
             subcategory_summary = subcategory_summary.sort_values(by='Percentage', ascending=False)# sort, desc.
 
-            pdf.set_font("Arial", size=10)  #  font sets
+            pdf.set_font("Helvetica", size=10)  #  font sets
             for index, row in subcategory_summary.iterrows():
-                pdf.cell(100, 10, row['Subcategory'], 0, 0, 'L') # list category
-                pdf.cell(40, 10, f"{row['amount']:.2f} EUR", 0, 0, 'R') # amount
-                pdf.cell(40, 10, f"{row['Percentage']:.1f}%", 0, 1, 'R') # percentage
-            pdf.set_font("Arial", size=12) #  font sets
+                pdf.cell(100, 10, row['Subcategory'], border=0, align='L') # list category
+                pdf.cell(40, 10, f"{row['amount']:.2f} EUR", border=0, align='R') # amount
+                pdf.cell(40, 10, f"{row['Percentage']:.1f}%", border=0, align='R', new_x="LMARGIN", new_y="NEXT") # percentage
+            pdf.set_font("Helvetica", size=12) #  font sets
         else:
-            pdf.cell(0, 10, "No expenses for this month.", ln=1) # if no expenses
+            pdf.cell(0, 10, "No expenses for this month.", new_x="LMARGIN", new_y="NEXT") # if no expenses
 
-    today = datetime.now().strftime("%Y-%m-%d") # current day date
-    pdf.output(f"{today}.pdf") # save pdf under current date
-    print(f"Report saved as {today}.pdf")
+    if filename is None:
+        filename = f"{datetime.now().strftime('%Y-%m-%d')}.pdf" # save pdf under current date
+    pdf.output(filename)
+    print(f"Report saved as {filename}")
+    return filename
 
 # Main function combines all the steps
-def reporting():
-    user_id = get_user_id() # from sync module
-    df = prepare_transactions(user_id) #returns df
-    if df is not None: # if df exists, creates pie and bar charts snd generation pdf named by current date
-        generate_charts(df)
-        generate_pdf_report(df)
-    else:
+# user_id, database_name and filename can be given by batch jobs, so no Splitwise call is needed
+def reporting(user_id=None, database_name=None, filename=None, chart_workers=None):
+    if user_id is None:
+        user_id = get_user_id() # from sync module
+    database_name = database_name or f"{user_id}.sqlite"
+    today = datetime.now().strftime("%Y-%m-%d")
+    filename = filename or f"{today}.pdf" # named by current date
+
+    # a report of an unchanged ledger on the same day is taken from the cache
+    built = [] # stays empty if the report came from the cache
+    def build_report():
+        built.append(True)
+        df = prepare_transactions(user_id, database_name) #returns df
+        if df is None:
+            return None
+        charts = generate_charts(df, max_workers=chart_workers) # creates pie and bar charts snd generation pdf
+        with open(generate_pdf_report(df, charts, user_id, filename), "rb") as file:
+            return file.read()
+
+    report = cache.cached(database_name, 'report-pdf', {'today': today}, build_report)
+    if report is None:
         print("Failed to prepare transaction data.") # handle errors
+    elif not built:
+        with open(filename, "wb") as file: # cached report, write it again
+            file.write(report)
+        print(f"Report saved as {filename}")
+    return filename if report is not None else None
 
 if __name__ == "__main__":
     reporting()
@@ -0,0 +1,38 @@
+from requests import Request, Session
+from splitwise import Splitwise
+import instrument
+
+# the private methods used and replaced below (splitwise 3.0.0). Without them the override would silently not
+# apply and requests would go to the live API, even with splitwise_url set
+for _name in ("_Splitwise__makeRequest", "_Splitwise__handleResponse", "_Splitwise__handleUppercaseBoolean", "SPLITWISE_BASE_URL"):
+    if not hasattr(Splitwise, _name):
+        raise ImportError(f"Unsupported splitwise version: Splitwise.{_name} is missing (splitwise==3.0.0 is required)")
+
+class PooledSplitwise(Splitwise):
+    """Splitwise client that sends every request over one requests.Session, so connections are kept alive.
+
+    The library opens (and closes) a new session for each call, this replaces its private request method.
+    base_url (e.g. http://127.0.0.1:8400/) replaces https://secure.splitwise.com/ in every request, the library
+    reads its URLs from class constants, so they cannot be changed per client.
+    """
+    def __init__(self, *args, base_url=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = Session()
+        self.base_url = base_url.rstrip("/") + "/" if base_url else None
+
+    def _Splitwise__makeRequest(self, url, method="GET", data=None, auth=None, files=None):
+        if self.base_url and url.startswith(Splitwise.SPLITWISE_BASE_URL):
+            url = self.base_url + url[len(Splitwise.SPLITWISE_BASE_URL):]
+        headers = {}
+        if auth is None:
+            if self.auth:
+                auth = self.auth
+            elif self.api_key:
+                headers = {'Authorization': 'Bearer {}'.format(self.api_key)}
+        data = self._Splitwise__handleUppercaseBoolean(data)
+        prepared = Request(method=method, url=url, headers=headers, data=data, auth=auth, files=files).prepare()
+        endpoint = url.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1] #e.g. get_expenses
+        instrument.count("splitwise.requests")
+        with instrument.span(f"splitwise.{endpoint}"):
+            response = self.session.send(prepared)
+        return self._Splitwise__handleResponse(response)
@@ -0,0 +1,195 @@
+# Local stand-in for the Splitwise and Frankfurter APIs, for offline benchmarks and load tests.
+# Serves the endpoints used by sync.py, base_calc.py and unrec_transact.py with seeded synthetic data, and can add
+# latency, random server errors and 429 rate limiting. Point the modules at it with these lines in settings.txt:
+#   splitwise_url=http://127.0.0.1:8400/
+#   frankfurter_url=http://127.0.0.1:8400/frankfurter
+# Usage: python standin_server.py [--port 8400] [--expenses 5000] [--latency-ms 50] [--error-rate 0.01] [--rate-limit 10]
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import date as Date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from generate_ledger import CURRENCIES, EXPENSE_SUBCATEGORIES, FRIEND_IDS, GROUP_IDS, USER_ID, synthetic_rate, synthetic_rate_series
+
+def user_json(user_id, first_name, last_name="Stand-in"):
+    return {"id": user_id, "first_name": first_name, "last_name": last_name, "email": f"{user_id}@example.com",
+            "registration_status": "confirmed", "picture": {"small": "", "medium": "", "large": ""}}
+
+class StandinData:
+    """Seeded Splitwise account: the current user, friends, groups, categories and nr_expenses expenses."""
+    def __init__(self, nr_expenses=5000, seed=1):
+        rng = random.Random(seed)
+        self.user = dict(user_json(USER_ID, "Stand-in"), default_currency="EUR", locale="en", date_format="DD/MM/YYYY", default_group_id=None)
+        self.friends = [dict(user_json(id_, f"Friend {id_}"), balance=[
+            {"currency_code": code, "amount": f"{rng.uniform(-50, 50):.2f}"} for code, _, _ in rng.sample(CURRENCIES, 2)])
+            for id_ in FRIEND_IDS]
+        now = datetime.now()
+        self.groups = [{"id": id_, "name": f"Group {id_}", "updated_at": now.isoformat() + "Z", "created_at": now.isoformat() + "Z",
+                        "simplify_by_default": False, "original_debts": [], "simplified_debts": [], "members": []}
+                       for id_ in GROUP_IDS if id_]
+        self.categories = [{"id": 1, "name": "Everyday", "subcategories": [{"id": id_, "name": name} for id_, name, _, _ in EXPENSE_SUBCATEGORIES]}]
+
+        # expenses were created over the last two years, some of them were changed or deleted later
+        self.expenses = []
+        codes, weights = zip(*[(code, weight) for code, weight, _ in CURRENCIES])
+        for index in range(nr_expenses):
+            created = now - timedelta(days=730 * (nr_expenses - index) / nr_expenses)
+            updated = created + timedelta(days=rng.choice([0, 0, 0, 1, 30]))
+            subcategory_id, name, _, amount = rng.choice(EXPENSE_SUBCATEGORIES)
+            cost = round(rng.lognormvariate(0, 0.6) * amount, 2)
+            friend_id = rng.choice(FRIEND_IDS)
+            self.expenses.append({
+                "id": 1000000 + index, "group_id": rng.choice(GROUP_IDS), "description": name, "repeats": False,
+                "repeat_interval": rng.choice([None] * 30 + ["monthly"]), "email_reminder": False, "email_reminder_in_advance": None,
+                "next_repeat": None, "details": None, "comments_count": 0, "payment": False, "creation_method": "equal",
+                "transaction_method": "offline", "transaction_confirmed": False, "cost": f"{cost:.2f}",
+                "currency_code": rng.choices(codes, weights)[0], "created_by": user_json(USER_ID, "Stand-in"),
+                "date": created.strftime("%Y-%m-%dT%H:%M:%SZ"), "created_at": created.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "updated_at": min(updated, now).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "deleted_at": min(updated, now).strftime("%Y-%m-%dT%H:%M:%SZ") if rng.random() < 0.02 else None,
+                "receipt": {"original": None, "large": None}, "category": {"id": subcategory_id, "name": name},
+                "updated_by": None, "deleted_by": None, "repayments": [],
+                "users": [{"user": user_json(USER_ID, "Stand-in"), "paid_share": f"{cost:.2f}", "owed_share": f"{cost / 2:.2f}", "net_balance": f"{cost / 2:.2f}"},
+                          {"user": user_json(friend_id, f"Friend {friend_id}"), "paid_share": "0.00", "owed_share": f"{cost / 2:.2f}", "net_balance": f"{-cost / 2:.2f}"}]})
+
+    def get_expenses(self, query):
+        """Expenses ordered by ID, filtered by updated_after and paged by offset/limit like the real API."""
+        updated_after = query.get("updated_after")
+        offset, limit = int(query.get("offset", 0)), int(query.get("limit", 20))
+        matching = [expense for expense in self.expenses if not updated_after or expense["updated_at"] > updated_after]
+        return {"expenses": matching[offset:offset + limit]}
+
+class RateLimiter:
+    """Token bucket shared by all handler threads, rate requests per second (None: unlimited)."""
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate or 0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server_version = "StandinServer/1.0"
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        server.count("requests")
+        if server.latency:
+            time.sleep(max(0.0, random.gauss(server.latency, server.latency / 4)))
+        if not server.limiter.allow():
+            server.count("429")
+            return self.reply(429, {"errors": {"base": ["Rate limit exceeded"]}}, {"Retry-After": "1"})
+        if server.error_rate and random.random() < server.error_rate:
+            server.count("errors")
+            return self.reply(random.choice([500, 502, 503]), {"errors": {"base": ["Injected server error"]}})
+
+        path = url.path.rstrip("/")
+        data = server.data
+        if path.startswith("/frankfurter/"):
+            return self.frankfurter(path[len("/frankfurter/"):], query)
+        routes = {
+            "/api/v3.0/get_current_user": lambda: {"user": data.user},
+            "/api/v3.0/get_friends": lambda: {"friends": data.friends},
+            "/api/v3.0/get_groups": lambda: {"groups": data.groups},
+            "/api/v3.0/get_categories": lambda: {"categories": data.categories},
+            "/api/v3.0/get_expenses": lambda: data.get_expenses(query),
+        }
+        if path in routes:
+            return self.reply(200, routes[path]())
+        self.reply(404, {"errors": {"base": [f"Unknown endpoint {path}"]}})
+
+    def frankfurter(self, path, query):
+        currencies = [code for code, _, _ in CURRENCIES if code != "EUR"]
+        if path == "latest": # all rates quoted from EUR, like /latest?from=EUR
+            today = Date.today().isoformat()
+            return self.reply(200, {"amount": 1.0, "base": "EUR", "date": today,
+                                    "rates": {code: round(1 / synthetic_rate(code, today), 5) for code in currencies}})
+        if ".." in path: # time series /start..end?from=X&to=EUR
+            start, end = path.split("..", 1)
+            currency = query.get("from", "USD")
+            if currency == "EUR" and "to" not in query: # every currency quoted from EUR, per day
+                series = {code: synthetic_rate_series(code, start, end or Date.today().isoformat()) for code in currencies}
+                rates = {}
+                for code, values in series.items():
+                    for day, rate in values.items():
+                        rates.setdefault(day, {})[code] = round(1 / rate, 5)
+                return self.reply(200, {"amount": 1.0, "base": "EUR", "start_date": start, "end_date": end, "rates": rates})
+            if currency not in currencies:
+                return self.reply(404, {"message": "not found"})
+            rates = synthetic_rate_series(currency, start, end or Date.today().isoformat())
+            return self.reply(200, {"amount": 1.0, "base": currency, "start_date": start, "end_date": end,
+                                    "rates": {day: {"EUR": rate} for day, rate in rates.items()}})
+        self.reply(404, {"message": "not found"})
+
+    def reply(self, status, body, headers=None):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args): #no line per request, the counters are printed at the end
+        pass
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, data, latency_ms=0, error_rate=0.0, rate_limit=None):
+        super().__init__(address, StandinHandler)
+        self.data = data
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.limiter = RateLimiter(rate_limit)
+        self.counters = {"requests": 0, "429": 0, "errors": 0}
+        self.counter_lock = threading.Lock()
+
+    def count(self, name):
+        with self.counter_lock:
+            self.counters[name] += 1
+
+def start_server(port=8400, nr_expenses=5000, seed=1, latency_ms=0, error_rate=0.0, rate_limit=None, host="127.0.0.1"):
+    """Start the server in a background thread (for scripts and benchmarks), returns it; stop it with shutdown()."""
+    server = StandinServer((host, port), StandinData(nr_expenses, seed), latency_ms, error_rate, rate_limit)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Splitwise and Frankfurter APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8400)
+    parser.add_argument("--expenses", type=int, default=5000, help="number of synthetic Splitwise expenses")
+    parser.add_argument("--seed", type=int, default=1, help="random seed of the synthetic data")
+    parser.add_argument("--latency-ms", type=float, default=0, help="mean added latency per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500/502/503")
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests per second before answering 429")
+    args = parser.parse_args()
+
+    server = StandinServer((args.host, args.port), StandinData(args.expenses, args.seed), args.latency_ms, args.error_rate, args.rate_limit)
+    print(f"Serving Splitwise at http://{args.host}:{args.port}/ and Frankfurter at http://{args.host}:{args.port}/frankfurter (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Requests: {server.counters['requests']}, rate limited (429): {server.counters['429']}, injected errors: {server.counters['errors']}")
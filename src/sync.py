@@ -1,7 +1,11 @@
 import os
+import random
 import sqlite3
-from datetime import datetime
-from splitwise import Splitwise
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import instrument
 
 def read_settings(settings_file="settings.txt"): #get the credentials
     settings = {} #dictionary to store and make the credentials accessible
@@ -16,7 +20,60 @@ def read_settings(settings_file="settings.txt"): #get the credentials
         return None
     return settings
 
+_service_urls = None #settings.txt entries read by service_url()
+
+def service_url(key, default):
+    """Base URL of an external service, e.g. frankfurter_url=http://127.0.0.1:8400/frankfurter in settings.txt
+    points the module at a local stand-in server (see standin_server.py). Without the entry the public API is used."""
+    global _service_urls
+    if _service_urls is None:
+        _service_urls = read_settings() if os.path.exists("settings.txt") else {}
+    return ((_service_urls or {}).get(key) or default).rstrip("/")
+
+_client = None #one authenticated client per process, see get_client()
+_client_lock = threading.Lock()
+
+def get_client(settings=None):
+    """Process-wide authenticated Splitwise client, built from settings.txt on first use. None if the settings are incomplete."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            settings = settings or read_settings()
+            if settings is None:
+                return None
+            from splitwise_client import PooledSplitwise #requests and splitwise are only loaded by commands that go online
+            try:
+                client = PooledSplitwise(settings['consumer_key'], settings['consumer_secret'], base_url=settings.get('splitwise_url'))
+                client.setAccessToken({'oauth_token': settings['access_token'], 'oauth_token_secret': settings['access_token_secret']})
+            except KeyError as e:
+                print(f"Error: Missing key '{e}' in settings.txt.")
+                return None
+            _client = client
+        return _client
+
+IDENTITY_FILE = "identity.txt" #user ID and database of the last authenticated user, stored next to the databases
+
+_identity = None #(user ID, database name) once known in this process
+
+def save_identity(user_id, database_name, identity_file=IDENTITY_FILE):
+    global _identity
+    _identity = (int(user_id), database_name)
+    with open(identity_file, "w") as file: #same key=value format as settings.txt
+        file.write(f"user_id={user_id}\ndatabase={database_name}\n")
+
+def load_identity(identity_file=IDENTITY_FILE):
+    """(user ID, database name) from memory or the identity file, None if the user was never authenticated here."""
+    global _identity
+    if _identity is None and os.path.exists(identity_file):
+        identity = read_settings(identity_file)
+        try:
+            _identity = (int(identity['user_id']), identity.get('database') or f"{identity['user_id']}.sqlite")
+        except (KeyError, ValueError):
+            return None
+    return _identity
+
 def create_tables(conn): #takes connection obj as argument
+    instrument.watch_connection(conn) #counts SQL statements while tracing is on
     cursor = conn.cursor() #cursor object to execute the queries here
     cursor.executescript("""
         CREATE TABLE IF NOT EXISTS "Groups" (groupID INTEGER PRIMARY KEY, "group" TEXT);
@@ -37,120 +94,413 @@ def create_tables(conn): #takes connection obj as argument
             transactionID INTEGER,
             userID INTEGER,
             amount FLOAT,
-            baseAmount FLOAT
+            baseAmount FLOAT,
+            baseUpdated TEXT
         );
         CREATE TABLE IF NOT EXISTS Categories (categoryID INTEGER PRIMARY KEY, category TEXT);
         CREATE TABLE IF NOT EXISTS Subcategories (subcategoryID INTEGER PRIMARY KEY, subcategory TEXT);
+        CREATE TABLE IF NOT EXISTS SyncState (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS FxRates (currency TEXT, date TEXT, rate FLOAT, PRIMARY KEY (currency, date));
+        CREATE TABLE IF NOT EXISTS MonthlySummary (
+            month TEXT,
+            type TEXT,
+            subcategoryID INTEGER,
+            total FLOAT,
+            items INTEGER,
+            positiveTotal FLOAT,
+            positiveItems INTEGER,
+            PRIMARY KEY (month, type, subcategoryID)
+        );
+    """)
+    #indexes first: the migrations below (e.g. the MonthlySummary fill of version 3) join through them
+    cursor.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_transactionitems_transactionid ON TransactionItems (transactionID);
+        CREATE INDEX IF NOT EXISTS idx_transactions_date ON Transactions (date);
+        CREATE INDEX IF NOT EXISTS idx_transactions_subcategoryid ON Transactions (subcategoryID);
     """)
+    migrate_schema(conn) #upgrade databases created by older versions
     conn.commit()  #save the creation of tables
 
-def sync_splitwise_data():
+SCHEMA_VERSION = 3 #stored in PRAGMA user_version, raised with every migration below
+
+def migrate_schema(conn):
+    """Bring an existing database up to SCHEMA_VERSION, changes are made in place."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1: #version 1: Transactions.date is stored as sortable ISO text (yyyy-mm-dd) instead of dd.mm.yyyy
+        conn.execute("""
+            UPDATE Transactions
+            SET date = substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2)
+            WHERE date GLOB '[0-9][0-9].[0-9][0-9].[0-9][0-9][0-9][0-9]'
+        """)
+    if version < 2: #version 2: TransactionItems.baseUpdated remembers which Transactions.updated the baseAmount was calculated for
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(TransactionItems)")]
+        if "baseUpdated" not in columns:
+            conn.execute("ALTER TABLE TransactionItems ADD COLUMN baseUpdated TEXT")
+    if version < 3: #version 3: MonthlySummary holds the per month totals, filled once from the existing ledger
+        refresh_monthly_summary(conn)
+    if version < SCHEMA_VERSION:
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+
+@instrument.traced("sql.refresh_monthly_summary")
+def refresh_monthly_summary(conn, months=None):
+    """Recalculate the MonthlySummary rows of the given months ('yyyy-mm'), or of every month if months is None.
+
+    The summary is keyed by (month, type, subcategoryID): type is 'Income' for subcategories 100-106, 'Expense'
+    otherwise, and transactions without a subcategory are stored under subcategoryID 0. total sums all baseAmounts,
+    positiveTotal only those of items with a positive amount (the paid shares shown in the reports).
+    Writers call this with the months they touched, before their commit, so the rollup never drifts from the ledger.
+    Every call also raises the ledger revision, which cache.py uses to notice changed ledgers.
+    """
+    bump_ledger_revision(conn)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS SummaryMonths (month TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM SummaryMonths")
+    if months is None:
+        conn.execute("DELETE FROM MonthlySummary")
+        conn.execute("INSERT INTO SummaryMonths (month) SELECT DISTINCT substr(date, 1, 7) FROM Transactions WHERE date IS NOT NULL")
+    else:
+        conn.executemany("INSERT OR IGNORE INTO SummaryMonths (month) VALUES (?)", [(month,) for month in months if month])
+        conn.execute("DELETE FROM MonthlySummary WHERE month IN (SELECT month FROM SummaryMonths)")
+    #one date index range per month, 'yyyy-mm-32' sorts after every day of the month
+    conn.execute("""
+        INSERT INTO MonthlySummary (month, type, subcategoryID, total, items, positiveTotal, positiveItems)
+        SELECT m.month,
+               CASE WHEN t.subcategoryID BETWEEN 100 AND 106 THEN 'Income' ELSE 'Expense' END,
+               COALESCE(t.subcategoryID, 0),
+               TOTAL(ti.baseAmount), COUNT(*),
+               TOTAL(CASE WHEN ti.amount > 0 THEN ti.baseAmount END), SUM(ti.amount > 0)
+        FROM SummaryMonths m
+        CROSS JOIN Transactions t ON t.date >= m.month || '-01' AND t.date < m.month || '-32'
+        CROSS JOIN TransactionItems ti ON ti.transactionID = t.transactionID
+        GROUP BY 1, 2, 3
+    """)
+
+def rebuild_summaries(folder="data"): #rebuild MonthlySummary from scratch in every user database of a folder
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.endswith(".sqlite"):
+            conn = sqlite3.connect(os.path.join(folder, file_name))
+            create_tables(conn)
+            refresh_monthly_summary(conn)
+            conn.commit()
+            conn.close()
+            print(f"Rebuilt the monthly summary of {os.path.join(folder, file_name)}")
+
+def upgrade_databases(folder="data"): #migrate every user database in a folder, e.g. data/*.sqlite
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.endswith(".sqlite"):
+            conn = sqlite3.connect(os.path.join(folder, file_name))
+            create_tables(conn)
+            conn.close()
+            print(f"Upgraded {os.path.join(folder, file_name)} to schema version {SCHEMA_VERSION}")
+
+def get_sync_state(conn, key): #read a stored value (e.g. the expense cursor) from the SyncState table
+    row = conn.execute("SELECT value FROM SyncState WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def set_sync_state(conn, key, value): #store or overwrite a value in the SyncState table
+    conn.execute("INSERT OR REPLACE INTO SyncState (key, value) VALUES (?, ?)", (key, value))
+
+LEDGER_REVISION_KEY = "ledger_revision" #SyncState key of a counter raised by every write to the ledger (see refresh_monthly_summary)
+
+def bump_ledger_revision(conn):
+    revision = get_sync_state(conn, LEDGER_REVISION_KEY)
+    set_sync_state(conn, LEDGER_REVISION_KEY, str(int(revision or 0) + 1))
+
+BALANCE_CHECKPOINT_KEY = "balance_checkpoint" #SyncState key of the income/expense totals up to an itemID (see unrec_transact.income_expenses)
+
+def clear_balance_checkpoint(conn): #called by writers that change or delete existing items, appended items are picked up by the checkpoint itself
+    conn.execute("DELETE FROM SyncState WHERE key = ?", (BALANCE_CHECKPOINT_KEY,))
+
+def sync_status(database_name): #short overview of a local database, no Splitwise call
+    if not os.path.exists(database_name):
+        print(f"Database '{database_name}' not found. Run a sync first.")
+        return
+    conn = sqlite3.connect(database_name)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        print(f"Database: {database_name} (schema version {version} of {SCHEMA_VERSION})")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "Transactions" in tables:
+            count, first, last = conn.execute("SELECT COUNT(*), MIN(date), MAX(date) FROM Transactions").fetchone()
+            print(f"Transactions: {count} ({first} to {last})" if count else "Transactions: 0")
+        if "SyncState" in tables:
+            print(f"Last change synced: {get_sync_state(conn, EXPENSES_CURSOR_KEY) or 'never'}")
+    finally:
+        conn.close()
+
+EXPENSES_PAGE_SIZE = 500 #number of expenses requested per API call
+EXPENSES_CURSOR_KEY = "expenses_updated_at" #SyncState key of the high-water mark (last updated_at seen)
+CURSOR_OVERLAP_SECONDS = 300 #updated_after lies this far before the high-water mark, see expenses_updated_after()
+
+DEFAULT_REQUESTS_PER_SECOND = 5 #API budget if settings.txt has no requests_per_second entry
+DEFAULT_MAX_WORKERS = 4 #parallel API calls if settings.txt has no max_workers entry
+MAX_RETRIES = 5 #attempts per API call on 429/5xx or connection errors (Splitwise and Frankfurter)
+BACKOFF_SECONDS = 1.0 #first retry delay, doubled on every further attempt (also used by base_calc)
+
+class RateLimiter:
+    """Spaces out API calls so that all threads together start at most `rate` calls per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock: #reserve the next free time slot
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def is_retryable(error): #rate limits, server errors and network problems are worth another try
+    from requests.exceptions import ConnectionError, Timeout
+    from splitwise.exception import SplitwiseException
+    if isinstance(error, (ConnectionError, Timeout)):
+        return True
+    if isinstance(getattr(error, "retryable", None), bool): #errors that know it themselves (base_calc.RateRequestError)
+        return error.retryable
+    if isinstance(error, SplitwiseException):
+        status = error.http_status
+        if isinstance(status, tuple): #the splitwise library stores the status code as a 1-tuple
+            status = status[0] if status else None
+        return status == 429 or (status is not None and status >= 500)
+    return False
+
+def retry_call(func, *args, before=None, counter="splitwise.retries", **kwargs):
+    """Call func, retrying errors that is_retryable accepts with exponential backoff (at least Retry-After) and jitter.
+
+    before() runs ahead of every attempt, e.g. the wait of a RateLimiter. Retries are counted as counter.
+    """
+    for attempt in range(MAX_RETRIES):
+        if before is not None:
+            before()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e) or attempt == MAX_RETRIES - 1:
+                raise
+            instrument.count(counter)
+            retry_after = getattr(e, "retry_after", None) or (getattr(e, "http_headers", None) or {}).get("Retry-After")
+            delay = max(float(retry_after) if retry_after and str(retry_after).isdigit() else 0, BACKOFF_SECONDS * 2 ** attempt)
+            time.sleep(delay + random.uniform(0, delay)) #jitter, so concurrent callers do not retry in lockstep
+
+def call_api(limiter, func, *args, **kwargs):
+    """Call a Splitwise method within the rate limit, retrying with exponential backoff on 429/5xx."""
+    return retry_call(func, *args, before=limiter.wait if limiter is not None else None, **kwargs)
+
+def fetch_expenses(s, updated_after=None, quiet=False, pool=None, limiter=None, pages_per_wave=1):
+    """Fetch all expenses changed after updated_after (all of them if no cursor is given).
+
+    The first page is requested alone (a warm sync usually fits into it), after that the pool
+    requests pages_per_wave pages at once until a short page shows up.
+    """
+    expenses = {}  #expense ID -> newest version, pages can overlap when expenses change during the sync
+    offset = 0
+    finished = False
+    wave = 1
+    while not finished:
+        offsets = [offset + i * EXPENSES_PAGE_SIZE for i in range(wave)]
+        fetch_page = lambda page_offset: call_api(limiter, s.getExpenses, limit=EXPENSES_PAGE_SIZE, offset=page_offset, updated_after=updated_after)
+        pages = pool.map(fetch_page, offsets) if pool is not None else map(fetch_page, offsets)
+        for page in pages: #map keeps the order of the offsets
+            for expense in page:
+                known = expenses.get(expense.id)
+                if known is None or (expense.updated_at or "") >= (known.updated_at or ""):
+                    expenses[expense.id] = expense
+            if len(page) < EXPENSES_PAGE_SIZE: #a short page means there is nothing left to fetch
+                finished = True
+        if not quiet:
+            print(f"Fetched {len(expenses)} expenses so far...")
+        offset += wave * EXPENSES_PAGE_SIZE
+        wave = max(1, pages_per_wave)
+    return list(expenses.values())
+
+def connect_database(db_name): #open a connection tuned for bulk writes
+    conn = sqlite3.connect(db_name)
+    conn.execute("PRAGMA journal_mode = WAL") #readers are not blocked while sync writes, and commits are cheaper
+    conn.execute("PRAGMA synchronous = NORMAL") #safe with WAL, avoids an fsync on every commit
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -20000") #about 20 MB page cache
+    return conn
+
+def expenses_updated_after(cursor_value):
+    """updated_after of the next sync: the stored high-water mark minus CURSOR_OVERLAP_SECONDS (None: full history).
+
+    updated_at has one-second resolution, so an expense committed later with the same (or a slightly older) timestamp
+    than the newest one seen would be skipped forever by an exact cursor. The overlap fetches such expenses again,
+    write_expenses leaves the unchanged ones alone.
+    """
+    if not cursor_value:
+        return None
+    high_water_mark = datetime.fromisoformat(cursor_value.replace("Z", "+00:00"))
+    return (high_water_mark - timedelta(seconds=CURSOR_OVERLAP_SECONDS)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+@instrument.traced("sql.write_expenses")
+def write_expenses(cursor, expenses, subcategory_dict):
+    """Write changed and deleted expenses with one executemany per statement. Returns (written, deleted) counts.
+
+    Expenses that are stored exactly like this already (fetched again by the cursor overlap) are skipped, so their
+    items keep their itemIDs and the balance checkpoint stays valid.
+    """
+    transaction_rows = [] #buffers for the batched inserts
+    item_rows = []
+    for expense in expenses:
+        if expense.deleted_at is not None:  #tombstones are only removed below
+            continue
+        formatted_date = datetime.fromisoformat(expense.date.replace("Z", "")).strftime("%Y-%m-%d") #keep only the day of the ISO 8601 timestamp
+
+        subcategory_id = None
+        if expense.category:
+            subcategory_name = expense.category.name  #gets subcatagory as catagory category.name returned by getExpenses method is also subcatagory
+            if subcategory_name in subcategory_dict:
+                subcategory_id = subcategory_dict[subcategory_name]  #lookup and assign the subcategory ID
+
+        repeat_interval = expense.repeat_interval if expense.repeat_interval else "One-time" #get the repeat interval if available
+
+        transaction_rows.append((expense.id, formatted_date, expense.group_id, subcategory_id, expense.description, expense.currency_code, repeat_interval, expense.updated_at))
+        for user_share in expense.users: #rows for the TransactionItems table
+            item_rows.append((expense.id, user_share.id, user_share.paid_share, None))
+
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS ChangedExpenses (transactionID INTEGER PRIMARY KEY)")
+    cursor.execute("DELETE FROM ChangedExpenses")
+    cursor.executemany("INSERT OR IGNORE INTO ChangedExpenses (transactionID) VALUES (?)", [(expense.id,) for expense in expenses])
+
+    #stored state of the fetched expenses, unchanged ones are taken out of ChangedExpenses again
+    stored = {row[0]: row for row in cursor.execute("""
+        SELECT t.transactionID, t.date, t.groupID, t.subcategoryID, t.description, t.currency, t.repeatInterval, t.updated
+        FROM ChangedExpenses c JOIN Transactions t ON t.transactionID = c.transactionID""")}
+    stored_items = {}
+    for transaction_id, user_id, amount in cursor.execute("SELECT ti.transactionID, ti.userID, ti.amount FROM ChangedExpenses c JOIN TransactionItems ti ON ti.transactionID = c.transactionID"):
+        stored_items.setdefault(transaction_id, []).append((user_id, amount))
+    new_items = {}
+    for transaction_id, user_id, amount, _ in item_rows:
+        new_items.setdefault(transaction_id, []).append((user_id, float(amount) if amount is not None else None))
+    unchanged = {row[0] for row in transaction_rows
+                 if stored.get(row[0]) == row and sorted(stored_items.get(row[0], []), key=repr) == sorted(new_items.get(row[0], []), key=repr)}
+    if unchanged:
+        cursor.executemany("DELETE FROM ChangedExpenses WHERE transactionID = ?", [(id_,) for id_ in unchanged])
+        transaction_rows = [row for row in transaction_rows if row[0] not in unchanged]
+        item_rows = [row for row in item_rows if row[0] not in unchanged]
+    deleted = sum(1 for expense in expenses if expense.deleted_at is not None and expense.id in stored)
+
+    #every changed or deleted expense loses its old rows first, this prevents duplicate user shares
+    months = {row[0] for row in cursor.execute("SELECT DISTINCT substr(t.date, 1, 7) FROM ChangedExpenses c JOIN Transactions t ON t.transactionID = c.transactionID")}
+    cursor.execute("DELETE FROM TransactionItems WHERE transactionID IN (SELECT transactionID FROM ChangedExpenses)")
+    if cursor.rowcount > 0: #old items were replaced, totals stored up to an older itemID are no longer valid
+        clear_balance_checkpoint(cursor.connection)
+    cursor.execute("DELETE FROM Transactions WHERE transactionID IN (SELECT transactionID FROM ChangedExpenses)")
+
+    cursor.executemany('''INSERT OR REPLACE INTO Transactions (transactionID, date, groupID, subcategoryID, description, currency, repeatInterval, updated)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', transaction_rows)
+    cursor.executemany('''INSERT INTO TransactionItems (transactionID, userID, amount, baseAmount) VALUES (?, ?, ?, ?)''', item_rows)
+    months.update(row[1][:7] for row in transaction_rows) #old and new months of every changed expense
+    refresh_monthly_summary(cursor.connection, months)
+    return len(transaction_rows), deleted
+
+def sync_splitwise_data(quiet=False): #quiet=True only prints errors
     settings = read_settings()
     if settings is None:
         return
 
+    def log(message): #progress output, silenced in quiet mode
+        if not quiet:
+            print(message)
+
     try:
-        consumer_key = settings['consumer_key']
-        consumer_secret = settings['consumer_secret']
-        access_token = settings['access_token']
-        access_token_secret = settings['access_token_secret']
-    except KeyError as e:
-        print(f"Error: Missing key '{e}' in settings.txt.")
+        requests_per_second = float(settings.get('requests_per_second', DEFAULT_REQUESTS_PER_SECOND))
+        max_workers = int(settings.get('max_workers', DEFAULT_MAX_WORKERS))
+    except ValueError as e:
+        print(f"Error: Invalid number in settings.txt: {e}")
         return
+    limiter = RateLimiter(requests_per_second) #shared by every worker thread
 
-    s = Splitwise(settings['consumer_key'], settings['consumer_secret'])
-    s.setAccessToken({'oauth_token': settings['access_token'], 'oauth_token_secret': settings['access_token_secret']})
-    user = s.getCurrentUser()  #get the current user
-    print(f"Authenticated user ID: {user.id}") #current user ID
+    s = get_client(settings)
+    if s is None:
+        return
+    user = call_api(limiter, s.getCurrentUser)  #get the current user, a sync always checks who is logged in
+    log(f"Authenticated user ID: {user.id}") #current user ID
 
     wise_db = f"{user.id}.sqlite" #db name
-    conn = sqlite3.connect(wise_db) #create the file, get a connection and store the connection in a variable
+    save_identity(user.id, wise_db) #the offline modules start from this file without calling Splitwise
+    conn = connect_database(wise_db) #create the file, get a connection and store the connection in a variable
     create_tables(conn) #pass the connection to create_tables() to create specified tables
     cursor = conn.cursor()  #cursor object for subsequent database operations
 
-    print("Fetching data from Splitwise...")
+    log("Fetching data from Splitwise...")
 
+    pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
     try:
-        groups = s.getGroups()
-        print(f"Fetched {len(groups)} groups")
-        for group in groups:
-            cursor.execute('''INSERT OR IGNORE INTO "Groups" (groupID, "group") VALUES (?, ?)''', (group.id, group.name))
-
-        friends = s.getFriends()
-        print(f"Fetched {len(friends)} friends")
-        for friend in friends:
-            cursor.execute('''INSERT OR IGNORE INTO Users (userID, name) VALUES (?, ?)''', (friend.id, f"{friend.first_name} {friend.last_name}"))
-
-        categories = s.getCategories() #returns a list of categories (including top-level categories and their potential subcategories)
-        print(f"Fetched {len(categories)} categories")
-        subcategory_dict = {}  #dictionary to map subcategory names to IDs
-        for category in categories: #get and store the catagories
-            cursor.execute('''INSERT OR IGNORE INTO Categories (categoryID, category) VALUES (?, ?)''', (category.id, category.name))
-            for subcategory in category.subcategories: #get and store the subcatagories
-                cursor.execute('''INSERT OR IGNORE INTO Subcategories (subcategoryID, subcategory) VALUES (?, ?)''', (subcategory.id, subcategory.name))
-                subcategory_dict[subcategory.name] = subcategory.id  #store the subcategory ID with name for later use
+        cursor_value = get_sync_state(conn, EXPENSES_CURSOR_KEY) #None on the first sync -> full history
+        groups_future = pool.submit(call_api, limiter, s.getGroups) #independent resources are fetched in parallel
+        friends_future = pool.submit(call_api, limiter, s.getFriends)
+        categories_future = pool.submit(call_api, limiter, s.getCategories)
+        expenses = fetch_expenses(s, updated_after=expenses_updated_after(cursor_value), quiet=quiet, pool=pool, limiter=limiter, pages_per_wave=max_workers)    #only expenses created, changed or deleted since the last sync
 
-        expenses = s.getExpenses(limit=50, offset=0)    #variable will contain a list of Expense objects, such as id, date etc
-        current_expense_ids = {expense.id for expense in expenses if expense.deleted_at is None}   #create a set of IDs of all current or undeleted expenses
-        cursor.execute("SELECT transactionID FROM Transactions")   #all transaction IDs (expense IDs) from the local Transactions table
-        stored_expenses = cursor.fetchall()   #fetche all results from the previous query ans store in variable
-        stored_expense_ids = {row[0] for row in stored_expenses}   #another set with the IDs of all expenses in the local database
-        deleted_expense_ids = stored_expense_ids - current_expense_ids   #use the sets to get the IDs that are no longer in Splitwise
+        groups = groups_future.result()
+        log(f"Fetched {len(groups)} groups")
+        cursor.executemany('''INSERT OR IGNORE INTO "Groups" (groupID, "group") VALUES (?, ?)''', [(group.id, group.name) for group in groups])
 
-        for id in deleted_expense_ids:  #iterate over the set of deleted IDs
-            cursor.execute("DELETE FROM TransactionItems WHERE transactionID = ?", (id,)) #remove associated transaction items (user shares)
-            cursor.execute("DELETE FROM Transactions WHERE transactionID = ?", (id,)) #remove the actual deleted expense entry
-            print(f"Deleted transaction ID: {id}")
+        friends = friends_future.result()
+        log(f"Fetched {len(friends)} friends")
+        cursor.executemany('''INSERT OR IGNORE INTO Users (userID, name) VALUES (?, ?)''', [(friend.id, f"{friend.first_name} {friend.last_name}") for friend in friends])
 
-        for expense in expenses:  #format the date from ISO 8601 to dd.mm.yyyy
-            if expense.deleted_at is not None:  #skip deleted expenses
-                continue
-            formatted_date = datetime.fromisoformat(expense.date.replace("Z", "")).strftime("%d.%m.%Y")
-
-            subcategory_id = None
-            if expense.category:
-                subcategory_name = expense.category.name  #gets subcatagory as catagory category.name returned by getExpenses method is also subcatagory
-                if subcategory_name in subcategory_dict:
-                    subcategory_id = subcategory_dict[subcategory_name]  #lookup and assign the subcategory ID
+        categories = categories_future.result() #returns a list of categories (including top-level categories and their potential subcategories)
+        log(f"Fetched {len(categories)} categories")
+        subcategory_dict = {}  #dictionary to map subcategory names to IDs
+        for category in categories:
+            for subcategory in category.subcategories:
+                subcategory_dict[subcategory.name] = subcategory.id  #store the subcategory ID with name for later use
+        cursor.executemany('''INSERT OR IGNORE INTO Categories (categoryID, category) VALUES (?, ?)''', [(category.id, category.name) for category in categories])
+        cursor.executemany('''INSERT OR IGNORE INTO Subcategories (subcategoryID, subcategory) VALUES (?, ?)''', [(id_, name) for name, id_ in subcategory_dict.items()])
 
-            repeat_interval = expense.repeat_interval if expense.repeat_interval else "One-time" #get the repeat interval if available
+        log(f"Fetched {len(expenses)} changed expenses" + (f" since {cursor_value}" if cursor_value else ""))
 
-            cursor.execute('''INSERT OR REPLACE INTO Transactions (transactionID, date, groupID, subcategoryID, description, currency, repeatInterval, updated) 
-                               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                           (expense.id, formatted_date, expense.group_id, subcategory_id, expense.description, expense.currency_code, repeat_interval, expense.updated_at))
+        high_water_mark = cursor_value
+        for expense in expenses:  #keep track of the newest updated_at we have seen
+            if expense.updated_at and (high_water_mark is None or expense.updated_at > high_water_mark):
+                high_water_mark = expense.updated_at
 
-            cursor.execute("DELETE FROM TransactionItems WHERE transactionID = ?", (expense.id,)) #prevent duplicate and clear old exp information
+        written, deleted = write_expenses(cursor, expenses, subcategory_dict)
+        log(f"Updated {written} transactions, deleted {deleted} transactions")
 
-            for user_share in expense.users: #populate the TransactionItems table
-                cursor.execute('''INSERT INTO TransactionItems (transactionID, userID, amount, baseAmount) VALUES (?, ?, ?, ?)''', (expense.id, user_share.id, user_share.paid_share, None))
-                print(f"Updated transaction ID: {expense.id}")
+        if high_water_mark: #move the cursor only after every change was written
+            set_sync_state(conn, EXPENSES_CURSOR_KEY, high_water_mark)
+        conn.commit() #everything above is written in one transaction
 
     except Exception as e:
+        conn.rollback() #keep the old cursor and data, so the next run fetches the same changes again
         print(f"Error fetching data: {e}")
     finally:
-        conn.commit()
+        pool.shutdown(wait=False, cancel_futures=True)
         conn.close()
-        print("Data synchronization complete!")
+        log("Data synchronization complete!")
 
 if __name__ == "__main__":
-    sync_splitwise_data()
+    import sys
+    if "--upgrade" in sys.argv: #only migrate the existing databases in data/, no Splitwise calls
+        upgrade_databases()
+    elif "--rebuild-summary" in sys.argv: #recalculate MonthlySummary in data/*.sqlite from the ledger
+        rebuild_summaries()
+    else:
+        sync_splitwise_data(quiet="--quiet" in sys.argv)
 
 #The function below was added by Tim for use in later tasks
 def get_user_id():
-    settings = read_settings()
-    if settings is None:
-        return
+    identity = load_identity() #no network call once a sync or an earlier run stored the identity
+    if identity is not None:
+        return identity[0]
 
-    try:
-        consumer_key = settings['consumer_key']
-        consumer_secret = settings['consumer_secret']
-        access_token = settings['access_token']
-        access_token_secret = settings['access_token_secret']
-    except KeyError as e:
-        print(f"Error: Missing key '{e}' in settings.txt.")
+    s = get_client()
+    if s is None:
         return
-
-    s = Splitwise(settings['consumer_key'], settings['consumer_secret'])
-    s.setAccessToken({'oauth_token': settings['access_token'], 'oauth_token_secret': settings['access_token_secret']})
     user = s.getCurrentUser()  #get the current user
-    return user.id
\ No newline at end of file
+    save_identity(user.id, f"{user.id}.sqlite")
+    return user.id
+
+def get_database_name(): #database of the current user, e.g. 98754612.sqlite
+    identity = load_identity()
+    if identity is not None:
+        return identity[1]
+    user_id = get_user_id()
+    return f"{user_id}.sqlite" if user_id is not None else None
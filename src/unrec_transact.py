@@ -1,45 +1,51 @@
+import json
 import sqlite3
-import requests
-from sync import get_user_id, read_settings
-from splitwise import Splitwise
+import time
+import instrument
+from base_calc import latest_rates
+from sync import BALANCE_CHECKPOINT_KEY, create_tables, get_client, get_sync_state, get_user_id, refresh_monthly_summary, set_sync_state
 from datetime import datetime
 
 
 # sum of base_amount from Income and Expenses (database)
-def income_expenses(database_name):
+# income: subCategoryId between 100 and 106, expenses: every other subcategory (transactions without one are left out).
+# With checkpoint=True the totals are stored in SyncState together with the highest itemID they include; the next call
+# only adds the items appended since then. itemIDs are AUTOINCREMENT and never reused, and writers that change or
+# delete existing items clear the checkpoint (sync.clear_balance_checkpoint), so the stored totals stay exact.
+@instrument.traced("sql.income_expenses")
+def income_expenses(database_name, checkpoint=True):
     try:
         conn = sqlite3.connect(database_name)  # connection to database
+        create_tables(conn)  # older databases get their MonthlySummary filled here
         cursor = conn.cursor()
-        # income transactions with description 'Income' or subCategoryId between 100 and 106
-        cursor.execute("""
-            SELECT SUM(baseAmount)
-            FROM TransactionItems
-            WHERE transactionID IN (
-                SELECT transactionID
-                FROM Transactions
-                WHERE description = 'Income'
-                OR subcategoryId BETWEEN 100 AND 106
-            )
-        """)
-        income = cursor.fetchone()[0]
-        if income is None:
-            income = 0.0
-
-        # calculating expenses
-        cursor.execute("""
-            SELECT SUM(baseAmount)
-            FROM TransactionItems
-            WHERE transactionID IN (
-                SELECT transactionID
-                FROM Transactions
-                WHERE description != 'Income'
-                AND (subcategoryId < 100 OR subcategoryId > 106)
-            )
-        """)
-        expenses = cursor.fetchone()[0]
-        if expenses is None:
-            expenses = 0.0
-
+        stored = get_sync_state(conn, BALANCE_CHECKPOINT_KEY) if checkpoint else None
+        if stored is None:
+            # full totals from the monthly rollup, the highest itemID is read in the same statement (same snapshot)
+            cursor.execute("""
+                SELECT TOTAL(CASE WHEN type = 'Income' THEN total END),
+                       TOTAL(CASE WHEN type = 'Expense' AND subcategoryID != 0 THEN total END),
+                       (SELECT MAX(itemID) FROM TransactionItems)
+                FROM MonthlySummary
+            """)
+            income, expenses, last_item_id = cursor.fetchone()
+        else:
+            last_item_id, income, expenses = json.loads(stored)
+            # one pass over the new items: itemID range on TransactionItems, primary key lookup on Transactions
+            cursor.execute("""
+                SELECT TOTAL(CASE WHEN t.subcategoryID BETWEEN 100 AND 106 THEN ti.baseAmount END),
+                       TOTAL(CASE WHEN t.subcategoryID < 100 OR t.subcategoryID > 106 THEN ti.baseAmount END),
+                       MAX(ti.itemID)
+                FROM TransactionItems ti
+                JOIN Transactions t ON t.transactionID = ti.transactionID
+                WHERE ti.itemID > ?
+            """, (last_item_id,))
+            new_income, new_expenses, new_last_item_id = cursor.fetchone()
+            income, expenses = income + new_income, expenses + new_expenses
+            last_item_id = new_last_item_id or last_item_id
+
+        if checkpoint:
+            set_sync_state(conn, BALANCE_CHECKPOINT_KEY, json.dumps([last_item_id or 0, income, expenses]))
+            conn.commit()
         conn.close()
         return income, expenses
     except sqlite3.Error as e:
@@ -47,43 +53,92 @@ def income_expenses(database_name):
         return 0.0, 0.0
 
 
-# Exchange Rate to convert currency to Euro using Frankfurter API
-def exchange_rate(base_currency, target_currency="EUR"):
-    try:
-        if base_currency == target_currency:
-            return 1.0
-        url = f"https://api.frankfurter.app/latest?from={base_currency}&to={target_currency}"
-        response = requests.get(url)
-        if response.status_code != 200:
-            raise ValueError(f"HTTP {response.status_code}: {response.text}")
-        data = response.json()
-        rate = data.get("rates", {}).get(target_currency)
-        if rate is None:
-            raise ValueError(f"Exchange rate not available for {base_currency} to {target_currency}")
-        return rate
-    except Exception as e:
-        raise ValueError(str(e))
+CACHE_SECONDS = 300 # exchange rates and friend balances are reused for this long, e.g. by repeated reconciliations
+_rate_cache = {} # (currency, target_currency) -> (time fetched, rate or None)
+_balance_cache = {} # "balances" -> (time fetched, {currency: {"owes": ..., "owed": ...}})
+
+# newest rates of the offline FX dataset quoted from target_currency like latest_rates, None without a dataset
+def offline_latest_rates(target_currency="EUR"):
+    from fx_dataset import open_dataset
+    dataset = open_dataset()
+    to_eur = dataset.latest() if dataset else {}
+    if target_currency not in to_eur:
+        return None
+    return {currency: to_eur[target_currency] / rate for currency, rate in to_eur.items() if currency != target_currency}
+
+
+# Exchange Rates to convert currencies to Euro using Frankfurter API, all currencies in one request
+def exchange_rates(currencies, target_currency="EUR"):
+    now = time.monotonic()
+    rates = {}
+    missing = []
+    for currency in set(currencies):
+        cached = _rate_cache.get((currency, target_currency))
+        if currency == target_currency:
+            rates[currency] = 1.0
+        elif cached and now - cached[0] < CACHE_SECONDS:
+            if cached[1] is not None: # None: not published by Frankfurter
+                rates[currency] = cached[1]
+        else:
+            missing.append(currency)
+    if missing:
+        try:
+            # every published rate quoted from the target currency (1 EUR = x USD), inverted below. Asking for all
+            # of them is one small response and never fails because of a single unsupported currency
+            # (pooled session, timeout and retries of base_calc)
+            latest = latest_rates(target_currency)
+        except Exception as e:
+            latest = offline_latest_rates(target_currency)
+            if latest is None:
+                raise ValueError(str(e))
+            print(f"Frankfurter not reachable ({e}), using the newest rates of the FX dataset")
+        for currency, rate in latest.items():
+            if rate:
+                _rate_cache[(currency, target_currency)] = (now, 1 / rate)
+                if currency in missing:
+                    rates[currency] = 1 / rate
+        for currency in missing:
+            if currency not in rates:
+                _rate_cache[(currency, target_currency)] = (now, None)
+    return rates # currencies without a rate are left out
+
+
+# balances of all friends per currency, getFriends returns every balance in one API call
+@instrument.traced("splitwise.friend_balances")
+def friend_balances():
+    cached = _balance_cache.get("balances")
+    if cached and time.monotonic() - cached[0] < CACHE_SECONDS:
+        return cached[1]
+    s = get_client()  # shared client from the sync module
+    if s is None:
+        raise ValueError("Splitwise settings are missing in settings.txt")
+    balances = {}
+    for friend in s.getFriends():
+        for balance in friend.getBalances() or []:
+            currency = balance.getCurrencyCode()
+            amount = float(balance.getAmount())
+            if currency not in balances:
+                balances[currency] = {"owes": 0.0, "owed": 0.0}
+            if amount < 0:
+                balances[currency]["owes"] += abs(amount)
+            else:
+                balances[currency]["owed"] += amount
+    _balance_cache["balances"] = (time.monotonic(), balances)
+    return balances
 
 
 # calculating Net Debt, access balances from friends, take currencies into account
 def net_debt():
     try:
-        settings = read_settings("settings.txt")  # settings file with access information
-        s = Splitwise(settings["consumer_key"], settings["consumer_secret"])
-        s.setAccessToken(
-            {"oauth_token": settings["access_token"], "oauth_token_secret": settings["access_token_secret"]}
-        )
-        balances = {}
-        for friend in s.getFriends():
-            for balance in friend.getBalances() or []:
-                currency = balance.getCurrencyCode()
-                amount = float(balance.getAmount())
-                if currency not in balances:
-                    balances[currency] = {"owes": 0.0, "owed": 0.0}
-                if amount < 0:
-                    balances[currency]["owes"] += abs(amount)
-                else:
-                    balances[currency]["owed"] += amount
+        balances = friend_balances()
+
+        # one rate request for every non-EUR currency
+        try:
+            rates = exchange_rates([currency for currency in balances if currency != "EUR"], "EUR")
+            rate_error = "rate not available"
+        except ValueError as ex:
+            rates = {}
+            rate_error = ex
 
         total_net_debt_eur = 0.0
         for currency, amounts in balances.items():
@@ -95,12 +150,11 @@ def net_debt():
 
             # Convert to EUR if necessary
             if currency != "EUR":
-                try:
-                    rate = exchange_rate(currency, "EUR")
-                    net_debt_eur = net_debt_value * rate
+                if currency in rates:
+                    net_debt_eur = net_debt_value * rates[currency]
                     print(f"  Net debt in EUR: {net_debt_eur:.2f}")
-                except ValueError as ex:
-                    print(f"  Could not fetch exchange rate for {currency} to EUR: {ex}")
+                else:
+                    print(f"  Could not fetch exchange rate for {currency} to EUR: {rate_error}")
                     net_debt_eur = 0.0
             else:
                 net_debt_eur = net_debt_value
@@ -123,6 +177,7 @@ def insert_transaction(database_name, amount):
 
         user_id = get_user_id()
         conn = sqlite3.connect(database_name)
+        create_tables(conn)
         cursor = conn.cursor()
 
         # Ensure subcategories exist
@@ -135,7 +190,7 @@ def insert_transaction(database_name, amount):
             ("Unrecorded Income", 106) if amount < 0 else ("Unrecorded Expense", 99)
         )
         base_amount = abs(amount)
-        current_date = datetime.now().strftime("%d.%m.%Y")
+        current_date = datetime.now().strftime("%Y-%m-%d")
 
         # Insert transaction
         cursor.execute("""
@@ -148,6 +203,7 @@ def insert_transaction(database_name, amount):
             INSERT INTO TransactionItems (transactionID, amount, baseAmount, userID)
             VALUES (?, ?, ?, ?)
         """, (transaction_id, base_amount, base_amount, user_id))
+        refresh_monthly_summary(conn, [current_date[:7]])
 
         conn.commit()
         conn.close()
@@ -192,7 +248,6 @@ def unrecorded_transactions(database_name):
 
 if __name__ == "__main__":
     import sync
-    user_id = sync.get_user_id()
-    database_name = str(user_id) + ".sqlite"
+    database_name = sync.get_database_name()
     unrecorded_transactions(database_name)
     print(factbalance)
\ No newline at end of file
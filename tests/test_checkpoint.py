@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import base_calc
+import benchmark
+import generate_ledger
+import sync
+import unrec_transact
+from sync import BALANCE_CHECKPOINT_KEY, get_sync_state
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    monkeypatch.setattr(base_calc, "fetch_rate_series", generate_ledger.synthetic_rate_series)  # no Frankfurter calls
+    database_name = generate_ledger.generate_ledger(str(tmp_path / "ledger.sqlite"), 2000, nr_years=2, quiet=True)
+    unrec_transact.income_expenses(database_name)  # stores the checkpoint
+    return database_name
+
+
+def stored_checkpoint(database_name):
+    conn = sqlite3.connect(database_name)
+    stored = get_sync_state(conn, BALANCE_CHECKPOINT_KEY)
+    conn.close()
+    return stored
+
+
+def assert_same_totals(database_name):
+    assert unrec_transact.income_expenses(database_name) == pytest.approx(
+        unrec_transact.income_expenses(database_name, checkpoint=False))
+
+
+def test_checkpoint_adds_items_appended_after_it(ledger):
+    before = unrec_transact.income_expenses(ledger, checkpoint=False)
+    conn = sqlite3.connect(ledger)
+    for subcategory_id, amount in [(101, 2500.0), (12, 80.0), (12, -30.0)]:
+        transaction_id = conn.execute("INSERT INTO Transactions (date, subcategoryID, description, currency, repeatInterval) "
+                                      "VALUES ('2025-03-14', ?, 'Appended', 'EUR', 'One-time')", (subcategory_id,)).lastrowid
+        conn.execute("INSERT INTO TransactionItems (transactionID, userID, amount, baseAmount) VALUES (?, 1, ?, ?)",
+                     (transaction_id, amount, amount))
+    sync.refresh_monthly_summary(conn, ["2025-03"])
+    conn.commit()
+    conn.close()
+
+    assert stored_checkpoint(ledger) is not None  # appending keeps the checkpoint, the next call adds the new items
+    assert_same_totals(ledger)
+    income, expenses = unrec_transact.income_expenses(ledger)
+    assert income == pytest.approx(before[0] + 2500.0)
+    assert expenses == pytest.approx(before[1] + 50.0)
+
+
+def test_base_amount_update_clears_checkpoint(ledger):
+    before = unrec_transact.income_expenses(ledger, checkpoint=False)
+    conn = sqlite3.connect(ledger)
+    # a changed currency (and updated time) makes update_base_amounts convert these items again
+    conn.execute("UPDATE Transactions SET currency = 'USD', updated = '2099-01-01T00:00:00Z' "
+                 "WHERE currency = 'EUR' AND transactionID % 5 = 0")
+    conn.commit()
+    conn.close()
+
+    base_calc.update_base_amounts(ledger)
+    assert stored_checkpoint(ledger) is None
+    assert_same_totals(ledger)
+    assert unrec_transact.income_expenses(ledger) != pytest.approx(before)
+
+
+def test_sync_replacing_expenses_clears_checkpoint(ledger):
+    before = unrec_transact.income_expenses(ledger, checkpoint=False)
+    conn = sqlite3.connect(ledger)
+    cursor = conn.cursor()
+    subcategory_dict = {name: id_ for id_, name in conn.execute("SELECT subcategoryID, subcategory FROM Subcategories")}
+    written, deleted = sync.write_expenses(cursor, benchmark.fake_expenses(conn, 50), subcategory_dict)
+    conn.commit()
+    conn.close()
+
+    assert written and deleted
+    assert stored_checkpoint(ledger) is None
+    assert_same_totals(ledger)
+    base_calc.update_base_amounts(ledger)  # base amounts of the replaced items, like a sync does afterwards
+    assert_same_totals(ledger)
+    assert unrec_transact.income_expenses(ledger) != pytest.approx(before)
@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import base_calc
+import benchmark
+import generate_ledger
+import income
+import sync
+import unrec_transact
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    monkeypatch.setattr(base_calc, "fetch_rate_series", generate_ledger.synthetic_rate_series)  # no Frankfurter calls
+    return generate_ledger.generate_ledger(str(tmp_path / "ledger.sqlite"), 2000, nr_years=2, quiet=True)
+
+
+def summary_rows(conn):
+    return conn.execute("""
+        SELECT month, type, subcategoryID, ROUND(total, 6), items, ROUND(positiveTotal, 6), positiveItems
+        FROM MonthlySummary ORDER BY 1, 2, 3
+    """).fetchall()
+
+
+def aggregated_rows(conn):  # the same rollup straight from the ledger
+    return conn.execute("""
+        SELECT substr(t.date, 1, 7),
+               CASE WHEN t.subcategoryID BETWEEN 100 AND 106 THEN 'Income' ELSE 'Expense' END,
+               COALESCE(t.subcategoryID, 0),
+               ROUND(TOTAL(ti.baseAmount), 6), COUNT(*),
+               ROUND(TOTAL(CASE WHEN ti.amount > 0 THEN ti.baseAmount END), 6), SUM(ti.amount > 0)
+        FROM Transactions t
+        JOIN TransactionItems ti ON ti.transactionID = t.transactionID
+        WHERE t.date IS NOT NULL
+        GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+    """).fetchall()
+
+
+def assert_summary_matches(database_name):
+    conn = sqlite3.connect(database_name)
+    assert summary_rows(conn) == aggregated_rows(conn)
+    conn.close()
+
+
+def test_summary_matches_ledger_after_each_writer(ledger, monkeypatch):
+    assert_summary_matches(ledger)
+
+    conn = sqlite3.connect(ledger)
+    subcategory_dict = {name: id_ for id_, name in conn.execute("SELECT subcategoryID, subcategory FROM Subcategories")}
+    sync.write_expenses(conn.cursor(), benchmark.fake_expenses(conn, 50), subcategory_dict)
+    conn.commit()
+    conn.close()
+    assert_summary_matches(ledger)
+
+    answers = iter(["Salary", "3100", "15.02.2025", "One-time"])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+    income.input_data(generate_ledger.USER_ID, ledger)
+    assert_summary_matches(ledger)
+
+    base_calc.update_base_amounts(ledger)  # the expenses written by the sync get their base amounts
+    assert_summary_matches(ledger)
+
+    monkeypatch.setattr(unrec_transact, "get_user_id", lambda: generate_ledger.USER_ID)
+    unrec_transact.insert_transaction(ledger, 42.5)
+    unrec_transact.insert_transaction(ledger, -17.25)
+    assert_summary_matches(ledger)
+
+    conn = sqlite3.connect(ledger)  # every writer actually wrote
+    assert conn.execute("SELECT COUNT(*) FROM Transactions WHERE description LIKE 'Unrecorded%'").fetchone()[0] == 2
+    assert conn.execute("SELECT COUNT(*) FROM TransactionItems WHERE amount = 3100").fetchone()[0] == 1
+    conn.close()
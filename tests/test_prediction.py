@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import prediction
+from sync import create_tables
+
+
+def make_ledger(path, one_off_rows=()):
+    conn = sqlite3.connect(path)
+    create_tables(conn)
+    conn.execute("INSERT INTO Subcategories (subcategoryID, subcategory) VALUES (12, 'Groceries')")
+    for transaction_id, (date, amount) in enumerate(one_off_rows, start=1):
+        conn.execute("INSERT INTO Transactions (transactionID, date, subcategoryID, description, currency, repeatInterval, updated) "
+                     "VALUES (?, ?, 12, 'Groceries', 'EUR', 'One-time', ?)", (transaction_id, date, date))
+        conn.execute("INSERT INTO TransactionItems (transactionID, userID, amount, baseAmount) VALUES (?, 1, ?, ?)",
+                     (transaction_id, amount, amount))
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+def test_monte_carlo_without_recurring_events_on_empty_ledger(tmp_path):
+    database_name = make_ledger(tmp_path / "empty.sqlite")
+    result = prediction.forecast(database_name, 1000.0, 2, nr_paths=50, seed=1, use_cache=False)
+    assert (result['bands']['P50'] == 1000.0).all()
+
+
+def test_monte_carlo_without_recurring_events_uses_one_off_history(tmp_path):
+    rows = [(f"2024-{month:02d}-15", 40.0) for month in range(1, 13)]
+    database_name = make_ledger(tmp_path / "one_off.sqlite", rows)
+    result = prediction.forecast(database_name, 1000.0, 2, nr_paths=200, seed=1, use_cache=False)
+    assert (result['balance']['balance'] == 1000.0).all()  # no recurring events
+    assert result['bands']['P50'].iloc[-1] < 1000.0  # random one-off expenses were drawn